@@ -1,8 +1,44 @@
 """Module that create the crop class for each water uptake simulation model"""
+import copy
 import math
 import numpy as np
 
-from functions import feddes_stress_factor, p_wofost
+from functions import feddes_stress_factor_profile, p_wofost
+
+
+def epic_uptake_scan(depth_demand, avail_water, stress_fact, active, cpwu):
+    """EPIC sequential water uptake down the soil profile
+
+    Each layer takes its share of the depth distributed demand minus a
+    fraction (cpwu) of what the layers above have already taken, so the
+    running uptake sum has to be carried from top to bottom.
+
+    depth_demand: cumulative demand down to each layer (SUM), mm
+    avail_water: water above the wilting point in each layer, mm
+    stress_fact: water stress factor of each layer
+    active: layers where water uptake is possible
+    cpwu: compensation fraction for uptake deficits of upper layers
+
+    >>> epic_uptake_scan([2.0, 3.0], [5.0, 5.0], [1.0, 0.5], [True, True], 0.5)
+    [2.0, 0.5]
+    """
+    water_uptake = [0.0] * len(depth_demand)
+    tot_water_uptake = 0.0
+    prev_depth_demand = 0.0
+    for lyr, demand in enumerate(depth_demand):
+        if active[lyr]:
+            uptake = (
+                min(
+                    demand - cpwu * tot_water_uptake - (1.0 - cpwu) * prev_depth_demand,
+                    avail_water[lyr],
+                )
+                * stress_fact[lyr]
+            )
+            if uptake > 0:
+                water_uptake[lyr] = uptake
+                tot_water_uptake += uptake
+        prev_depth_demand = demand
+    return water_uptake
 
 
 class Crop(object):
@@ -53,6 +89,57 @@ class Crop(object):
             self.root_dens[lyr] = sheet_soil.cell(9 + lyr, 9).value
             self.root_fraction[lyr] = sheet_soil.cell(9 + lyr, 10).value
         self.root_depth = sheet_soil.cell(3, 4).value
+        # Soils the DSSAT and EPIC constants were computed for
+        self.dssat_soil = None
+        self.epic_soil = None
+        # Root fraction and parameters the Campbell conductances were
+        # computed for
+        self.campbell_key = None
+        self.campbell_root_fraction = None
+
+    def clone(self):
+        """Returns a copy of the crop that shares the crop parameters and has
+        its own water uptake arrays"""
+        crop = copy.copy(self)
+        for name in CropSpec.MUTABLE:
+            setattr(crop, name, getattr(self, name).copy())
+        return crop
+
+    def state(self):
+        """Returns a copy of the values that change during the simulation,
+        the CropSpec.MUTABLE arrays and STATE_SCALARS"""
+        state = {name: getattr(self, name).copy() for name in CropSpec.MUTABLE}
+        for name in CropSpec.STATE_SCALARS:
+            if hasattr(self, name):
+                state[name] = getattr(self, name)
+        return state
+
+    def restore(self, state):
+        """Sets the values of a crop state, see state"""
+        for name in CropSpec.MUTABLE:
+            assert len(state[name]) == len(getattr(self, name)), (
+                "crop state of another soil profile"
+            )
+            getattr(self, name)[:] = state[name]
+        self.campbell_key = None
+        for name in CropSpec.STATE_SCALARS:
+            if name in state:
+                setattr(self, name, state[name])
+
+    def bind_dssat(self, soil):
+        """Computes the DSSAT per-soil constants once for the bound soil
+
+        soil: soil class with properties
+        """
+        CONV2 = 100  # convert m to cm
+        if self.dssat_soil is soil:
+            return
+        self.dssat_soil = soil
+        # Constant 2
+        self.dssat_const2 = np.where(
+            soil.perm_wilt_point > 0.3, 45, 120 - 250 * soil.perm_wilt_point
+        )
+        self.dssat_layer_thickness = soil.layer_thickness * CONV2  # cm
 
     def water_uptake_dssat(self, soil):
         """DSSAT model water uptake
@@ -73,58 +160,35 @@ class Crop(object):
         original source code: ROOTWU.FOR
         """
         CONV1 = 1e-4  # convert m/m3 to cm/cm3
-        CONV2 = 100  # convert m to cm
         CONV3 = 10  # convert cm to mm
+        CONST1 = 1.3e-3
+        CONST3 = 7.01
 
+        self.bind_dssat(soil)
         daily_ref_evap_transp = soil.daily_ref_evap_transp
         transp_pot = daily_ref_evap_transp * self.light_intercpt
         root_dens = self.root_dens * CONV1  # cm root / cm3 soil
-        CONST1 = 1.3e-3
-        CONST2 = np.zeros(soil.total_layers)
-        CONST3 = 7.01
-        layer_thickness = soil.layer_thickness * CONV2
+        avail_water = soil.water_content - soil.perm_wilt_point
+        # Water uptake per unit root length, only in rooted layers above
+        # the wilting point
+        active = (root_dens > 0.00001) & (avail_water > 0)
         water_uptake = np.zeros(soil.total_layers)
-        # Constant 2
-        for lyr in soil.layers:
-            CONST2[lyr] = 120 - 250 * soil.perm_wilt_point[lyr]
-            if soil.perm_wilt_point[lyr] > 0.3:
-                CONST2[lyr] = 45
-        # Water uptake per unit root length
-        for lyr in soil.layers:
-            if root_dens[lyr] <= 0.00001 or (
-                soil.water_content[lyr] <= soil.perm_wilt_point[lyr]
-            ):
-                water_uptake[lyr] = 0
-            else:
-                water_uptake[lyr] = (
-                    CONST1
-                    * math.exp(
-                        min(
-                            (
-                                CONST2[lyr]
-                                * (soil.water_content[lyr] - soil.perm_wilt_point[lyr])
-                            ),
-                            40,
-                        )
-                    )
-                    / (CONST3 - math.log(root_dens[lyr]))
-                )
-                water_uptake[lyr] = min(water_uptake[lyr], self.dssat_max_water_uptake)
-            # Water uptake in [cm/d] volume
-            water_uptake[lyr] = (
-                water_uptake[lyr] * layer_thickness[lyr] * root_dens[lyr]
-            )
-            # Water uptake in [mm/d] volume
-            water_uptake[lyr] = water_uptake[lyr] * CONV3
+        water_uptake[active] = np.minimum(
+            CONST1
+            * np.exp(np.minimum(self.dssat_const2[active] * avail_water[active], 40))
+            / (CONST3 - np.log(root_dens[active])),
+            self.dssat_max_water_uptake,
+        )
+        # Water uptake in [cm/d] volume and then in [mm/d] volume
+        water_uptake = water_uptake * self.dssat_layer_thickness * root_dens * CONV3
         # Total water uptake [mm/d]
         crop_transp = water_uptake.sum()
         min_transp = min(transp_pot, crop_transp)
         # Update crop arrays
-        for lyr in soil.layers:
-            if min_transp > 0:
-                self.water_uptake[lyr] = water_uptake[lyr] * (min_transp / crop_transp)
-            else:
-                self.water_uptake[lyr] = 0
+        if min_transp > 0:
+            self.water_uptake[:] = water_uptake * (min_transp / crop_transp)
+        else:
+            self.water_uptake[:] = 0
         self.att_transp = self.water_uptake.sum()  # mm/day
         self.cum_transp += self.att_transp  # mm
         self.transp_ratio = self.att_transp / transp_pot
@@ -210,19 +274,18 @@ class Crop(object):
         P3 = soil.perm_wilt_point_pot.mean()  # -8000 # J/kg wilting point
         daily_ref_evap_transp = soil.daily_ref_evap_transp
         transp_pot = daily_ref_evap_transp * self.light_intercpt
-        for lyr in soil.layers:
-            stress_fact = feddes_stress_factor(
-                transp_pot,
-                soil.water_potential[lyr],
-                self.P0,
-                P1,
-                self.P2L,
-                self.P2H,
-                P3,
-                self.R2H,
-                self.R2L,
-            )
-            self.water_uptake[lyr] = stress_fact * self.root_fraction[lyr] * transp_pot
+        stress_fact = feddes_stress_factor_profile(
+            transp_pot,
+            soil.water_potential,
+            self.P0,
+            P1,
+            self.P2L,
+            self.P2H,
+            P3,
+            self.R2H,
+            self.R2L,
+        )
+        self.water_uptake[:] = stress_fact * self.root_fraction * transp_pot
         self.att_transp = self.water_uptake.sum()  # mm/day
         self.cum_transp += self.att_transp
         self.expect_transp = transp_pot
@@ -262,12 +325,71 @@ class Crop(object):
             if stress_fact < 0:
                 stress_fact = 0
             self.water_uptake[lyr] = stress_fact * self.root_fraction[lyr] * transp_pot
+        # Root fraction changed in place
+        self.campbell_key = None
         self.att_transp = self.water_uptake.sum()  # mm/day
         self.cum_transp += self.att_transp
         self.expect_transp = transp_pot
         self.cum_pot_transp += self.expect_transp
         self.transp_ratio = self.att_transp / transp_pot
 
+    def bind_campbell(self):
+        """Computes the Campbell plant hydraulic conductances once for the
+        current root distribution and crop parameters
+
+        Only the soil water potential changes from day to day, so the
+        conductances are recomputed only when the root fraction, the light
+        interception or the Campbell crop parameters change.
+        """
+        WAT_POT_FIELD_CAP = -33
+        key = (
+            self.light_intercpt,
+            self.campbell_max_daily_transp,
+            self.leaf_water_pot_stress_onset,
+        )
+        # The root fraction is compared by identity, the methods that change
+        # it in place reset campbell_key
+        if (
+            self.campbell_key == key
+            and self.campbell_root_fraction is self.root_fraction
+        ):
+            return
+        self.campbell_key = key
+        self.campbell_root_fraction = self.root_fraction
+        root_activity = 1
+        salinity_factor = 1
+        max_pot_transp = self.campbell_max_daily_transp * self.light_intercpt
+
+        # Plant hydraulic conductance (kg s m-4)
+        tot_plant_hydr_cond = max_pot_transp / (
+            WAT_POT_FIELD_CAP - self.leaf_water_pot_stress_onset
+        )
+        # assumption of 2/3 of plant hydraulic conductance is from roots
+        tot_root_hydr_cond = tot_plant_hydr_cond / 0.65
+        # assumption of 1/3 of plant hydraulic conductivity is from shoots
+        tot_shoot_hydr_cond = tot_plant_hydr_cond / 0.35
+
+        root_cond_adj = root_activity * self.root_fraction * salinity_factor
+        tot_root_cond_adj = root_cond_adj.sum()
+
+        # Root, shoot and plant hydraulic conductance(kg s m-4)
+        rooted = root_cond_adj > 0
+        root_hydr_cond = tot_root_hydr_cond * root_cond_adj[rooted]
+        shoot_hydr_cond = (
+            tot_shoot_hydr_cond * root_cond_adj[rooted] / tot_root_cond_adj
+        )
+        plant_hydr_cond = np.zeros(len(root_cond_adj))
+        plant_hydr_cond[rooted] = (
+            root_hydr_cond * shoot_hydr_cond / (root_hydr_cond + shoot_hydr_cond)
+        )
+
+        tot_root_hydr_cond *= tot_root_cond_adj
+        self.campbell_root_cond_adj = root_cond_adj
+        self.campbell_plant_hydr_cond = plant_hydr_cond
+        self.campbell_tot_plant_hydr_cond = (
+            tot_root_hydr_cond * tot_shoot_hydr_cond
+        ) / (tot_root_hydr_cond + tot_shoot_hydr_cond)
+
     def water_uptake_campbell(self, soil):
         """CropSyst/Campbell model daily water uptake
 
@@ -281,61 +403,16 @@ class Crop(object):
          eds. Madison, WI: ASA/CSSA/SSSA.
         """
         daily_ref_evap_transp = soil.daily_ref_evap_transp
-        root_hydr_cond = np.zeros(soil.total_layers)
-        shoot_hydr_cond = np.zeros(soil.total_layers)
-        plant_hydr_cond = np.zeros(soil.total_layers)
-        root_activity = np.zeros(soil.total_layers)
-        root_cond_adj = np.zeros(soil.total_layers)
-        tot_root_cond_adj = 0
-        salinity_factor = np.zeros(soil.total_layers)
-        soil_water_pot_avg = 0
-        WAT_POT_FIELD_CAP = -33
 
         # Transpiration
         self.pot_transp = daily_ref_evap_transp * self.light_intercpt
         self.max_pot_transp = self.campbell_max_daily_transp * self.light_intercpt
         self.expect_transp = min(self.pot_transp, self.max_pot_transp)  # mm/day
 
-        # Plant hydraulic conductance (kg s m-4)
-        tot_plant_hydr_cond = self.max_pot_transp / (
-            WAT_POT_FIELD_CAP - self.leaf_water_pot_stress_onset
-        )
-        # assumption of 2/3 of plant hydraulic conductance is from roots
-        tot_root_hydr_cond = tot_plant_hydr_cond / 0.65
-        # assumption of 1/3 of plant hydraulic conductivity is from shoots
-        tot_shoot_hydr_cond = tot_plant_hydr_cond / 0.35
-
-        for lyr in soil.layers:
-            root_activity[lyr] = 1
-            salinity_factor[lyr] = 1
-            root_cond_adj[lyr] = (
-                root_activity[lyr] * self.root_fraction[lyr] * salinity_factor[lyr]
-            )
-            root_hydr_cond[lyr] = tot_root_hydr_cond * root_cond_adj[lyr]
-            tot_root_cond_adj += root_cond_adj[lyr]
-
-        # Root, shoot and plant hydraulic conductance(kg s m-4)
-        for lyr in soil.layers:
-            if root_cond_adj[lyr] > 0:
-                shoot_hydr_cond[lyr] = (
-                    tot_shoot_hydr_cond * root_cond_adj[lyr] / tot_root_cond_adj
-                )
-                plant_hydr_cond[lyr] = (
-                    root_hydr_cond[lyr]
-                    * shoot_hydr_cond[lyr]
-                    / (root_hydr_cond[lyr] + shoot_hydr_cond[lyr])
-                )
-            else:
-                plant_hydr_cond[lyr] = 0
-
-        tot_root_hydr_cond *= tot_root_cond_adj
-        tot_plant_hydr_cond = (tot_root_hydr_cond * tot_shoot_hydr_cond) / (
-            tot_root_hydr_cond + tot_shoot_hydr_cond
-        )
-
+        self.bind_campbell()
+        tot_plant_hydr_cond = self.campbell_tot_plant_hydr_cond
         if tot_plant_hydr_cond > 0:
-            for lyr in soil.layers:
-                soil_water_pot_avg += soil.water_potential[lyr] * root_cond_adj[lyr]
+            soil_water_pot_avg = soil.water_potential.dot(self.campbell_root_cond_adj)
             leaf_water_pot = (
                 soil_water_pot_avg - self.expect_transp / tot_plant_hydr_cond
             )
@@ -376,63 +453,143 @@ class Crop(object):
                 self.att_transp = self.expect_transp
                 transp_ratio = 1
             # crop water uptake (kg/m2/d = mm/d)
-            for lyr in soil.layers:
-                self.water_uptake[lyr] = (
-                    plant_hydr_cond[lyr]
-                    * (soil.water_potential[lyr] - leaf_water_pot)
-                    * transp_ratio
-                )
-                if self.water_uptake[lyr] < 0:
-                    self.water_uptake[lyr] = 0
+            np.maximum(
+                self.campbell_plant_hydr_cond
+                * (soil.water_potential - leaf_water_pot)
+                * transp_ratio,
+                0,
+                out=self.water_uptake,
+            )
         self.crop_transp = self.water_uptake.sum()  # mm/day
         self.cum_transp += self.crop_transp
         self.cum_pot_transp += self.expect_transp
         self.transp_ratio = self.crop_transp / self.expect_transp
 
+    def bind_epic(self, soil):
+        """Computes the EPIC per-soil terms once for the bound soil
+
+        soil: soil class with properties
+        """
+        WATER_DENSITY = 1000
+        RD = 1
+        if self.epic_soil is soil:
+            return
+        self.epic_soil = soil
+        # Depth distribution of the water use, scaled daily by the demand
+        self.epic_depth_dist = 1 - np.exp(
+            -self.water_extraction_dist * soil.cum_depth / RD
+        )
+        self.epic_dist_total = 1 - math.exp(-self.water_extraction_dist)
+        # Wilting point and field capacity water (mm) and their logarithms
+        self.epic_blm = soil.perm_wilt_point * soil.layer_thickness * WATER_DENSITY
+        self.epic_log_blm = np.log(self.epic_blm)
+        self.epic_log_fc = np.log(
+            soil.field_capacity * soil.layer_thickness * WATER_DENSITY
+        )
+
     def water_uptake_epic(self, soil):
         """EPIC latest EPIC0810"""
         WATER_DENSITY = 1000
-        self.water_uptake = np.zeros(soil.total_layers)
-        SUM = np.zeros(soil.total_layers)
-        daily_ref_evap_transp = soil.daily_ref_evap_transp
-        EP = daily_ref_evap_transp * self.light_intercpt
-        UB1 = self.water_extraction_dist
-        UOB = 1 - math.exp(-self.water_extraction_dist)
-        RD = 1
-        RGS = 1
         CPWU = 0.5
-        UX = 0
         TOS = 0
         SCRP211 = 9  # 9.6991521 rounded param of s-curve solved using excel
         SCRP212 = 0.005  # 0.004988621 rounded param s-curve solved using excel
-        for lyr in soil.layers:
-            BLM = soil.perm_wilt_point[lyr] * soil.layer_thickness[lyr] * WATER_DENSITY
-            FC = soil.field_capacity[lyr] * soil.layer_thickness[lyr] * WATER_DENSITY
-            ST = soil.water_content[lyr] * soil.layer_thickness[lyr] * WATER_DENSITY
-            XX = math.log(BLM)
-
-            SUM[lyr] = EP * (1 - math.exp(-UB1 * soil.cum_depth[lyr] / RD)) / UOB
-
-            WTN = max(
-                5, 10 ** (3.1761 - 1.6576 * ((math.log(ST) - XX) / (math.log(FC) - XX)))
-            )
-            XX = TOS + WTN
-            if XX < 5000:
-                F = 1 - XX / (XX + math.exp(SCRP211 - SCRP212 * XX))
-                self.water_uptake[lyr] = (
-                    min(
-                        SUM[lyr] - CPWU * self.water_uptake.sum() - (1.0 - CPWU) * UX,
-                        ST - BLM,
-                    )
-                    * RGS
-                    * F
+        self.bind_epic(soil)
+        daily_ref_evap_transp = soil.daily_ref_evap_transp
+        EP = daily_ref_evap_transp * self.light_intercpt
+        SUM = EP * self.epic_depth_dist / self.epic_dist_total
+        ST = soil.water_content * soil.layer_thickness * WATER_DENSITY
+        WTN = np.maximum(
+            5,
+            10
+            ** (
+                3.1761
+                - 1.6576
+                * (
+                    (np.log(ST) - self.epic_log_blm)
+                    / (self.epic_log_fc - self.epic_log_blm)
                 )
-                if self.water_uptake[lyr] < 0:
-                    self.water_uptake[lyr] = 0
-            UX = SUM[lyr]
+            ),
+        )
+        XX = TOS + WTN
+        F = 1 - XX / (XX + np.exp(SCRP211 - SCRP212 * XX))
+        self.water_uptake[:] = epic_uptake_scan(
+            SUM.tolist(),
+            (ST - self.epic_blm).tolist(),
+            F.tolist(),
+            (XX < 5000).tolist(),
+            CPWU,
+        )
 
         self.att_transp = self.water_uptake.sum()
         self.cum_transp += self.att_transp
         self.expect_transp = EP
         self.cum_pot_transp += self.expect_transp
         self.transp_ratio = self.att_transp / EP
+
+
+# Water uptake kernel of each model, called once a day as kernel(crop, soil)
+UPTAKE_MODELS = {
+    "campbell": Crop.water_uptake_campbell,
+    "dssat": Crop.water_uptake_dssat,
+    "apsim": Crop.water_uptake_apsim,
+    "feddes": Crop.water_uptake_feddes,
+    "epic": Crop.water_uptake_epic,
+    "wofost": Crop.water_uptake_wofost,
+}
+
+
+def register_model(name, kernel):
+    """Adds a water uptake model, or replaces the kernel of a model
+
+    name: model name
+    kernel: function called once a day as kernel(crop, soil) that sets the
+     crop water uptake and transpiration
+    """
+    UPTAKE_MODELS[name] = kernel
+
+
+class CropSpec(object):
+    """Crop parameters parsed once from the input workbook
+
+    The arrays of the spec are read-only. fresh_state returns a new crop in
+    its initial state, sharing them and copying only the arrays that change
+    during the simulation.
+    """
+
+    # Arrays that change during the simulation (WOFOST rewrites the root
+    # fraction)
+    MUTABLE = ("water_uptake", "root_fraction", "conductance", "leaf_water_potential")
+    # Daily and cumulative values that change during the simulation
+    STATE_SCALARS = (
+        "leaf_water_pot",
+        "soil_water_pot_avg",
+        "transp_ratio",
+        "crop_transp",
+        "pot_transp",
+        "max_pot_transp",
+        "att_transp",
+        "expect_transp",
+        "cum_transp",
+        "cum_pot_transp",
+        "light_intercpt",
+    )
+
+    def __init__(self, crop_no, sim_length, book, soil_spec):
+        self.crop = Crop(crop_no, sim_length, book, soil_spec)
+        self.freeze()
+
+    def __setstate__(self, state):
+        # Unpickled arrays are writeable again
+        self.__dict__.update(state)
+        self.freeze()
+
+    def freeze(self):
+        """Makes the crop arrays read-only"""
+        for value in vars(self.crop).values():
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+
+    def fresh_state(self):
+        """Returns a new crop in its initial state"""
+        return self.crop.clone()
@@ -0,0 +1,544 @@
+"""Module that runs many soil and crop scenarios of one water uptake model at
+once, with the state of all scenarios held in (scenarios, layers) arrays
+
+The per layer arrays are views of one contiguous (properties, scenarios,
+layers) block, in float64 or, to halve the memory of large ensembles, in
+float32 (see precision_report for the deviation it causes).
+"""
+import numpy as np
+
+from functions import (
+    feddes_stress_factor_profile,
+    p_wofost,
+    water_potential,
+)
+from Soil_class import LAYER_COLUMNS, MANUAL_PROPERTIES, build_soils
+
+# Soil properties stacked per layer
+SOIL_LAYER_PROPERTIES = [
+    "layer_thickness",
+    "cum_depth",
+    "field_capacity",
+    "perm_wilt_point",
+    "porosity",
+    "b_value",
+    "kl",
+    "air_entry_potential",
+    "field_capacity_water_potential",
+    "perm_wilt_point_pot",
+    "water_content",
+    "water_potential",
+]
+# Crop properties stacked per layer
+CROP_LAYER_PROPERTIES = ["root_dens", "root_fraction"]
+# Crop parameters, one value per scenario
+CROP_PARAMETERS = [
+    "campbell_max_daily_transp",
+    "dssat_max_water_uptake",
+    "P0",
+    "P2L",
+    "P2H",
+    "R2H",
+    "R2L",
+    "leaf_water_pot_stress_onset",
+    "leaf_water_pot_wilt_point",
+    "water_extraction_dist",
+]
+# Soil flag of each manually entered soil property
+MANUAL_FLAGS = {
+    "organic_matter": "manual_organic_matter",
+    "bulk_density": "manual_bulk_density",
+    "field_capacity": "manual_field_capacity",
+    "perm_wilt_point": "manual_permanent_wilt_point",
+}
+UPTAKE_MODELS = ["campbell", "dssat", "apsim", "feddes", "epic", "wofost"]
+# Per layer arrays packed in the layer block
+LAYER_PROPERTIES = SOIL_LAYER_PROPERTIES + CROP_LAYER_PROPERTIES + ["water_uptake"]
+
+
+class Ensemble(object):
+    """Scenarios x layers state of a set of soil and crop pairs"""
+
+    def __init__(self, soils, crops, dtype=np.float64):
+        """A new ensemble with one scenario for each soil and crop pair
+
+        soils: soil instances, all with the same number of layers
+        crops: crop instances matching soils
+        dtype: float type of the ensemble arrays, np.float32 halves their
+         memory
+        """
+        assert len(soils) == len(crops), "one crop is needed for each soil"
+        self.WATER_DENSITY = soils[0].WATER_DENSITY
+        self.total_scenarios = len(soils)
+        self.total_layers = soils[0].total_layers
+        self.dtype = np.dtype(dtype)
+        self.layer_block = np.empty(
+            (len(LAYER_PROPERTIES), self.total_scenarios, self.total_layers),
+            self.dtype,
+        )
+        self.set_views()
+        for name in SOIL_LAYER_PROPERTIES:
+            getattr(self, name)[...] = [getattr(soil, name) for soil in soils]
+        for name in CROP_LAYER_PROPERTIES + ["water_uptake"]:
+            getattr(self, name)[...] = [getattr(crop, name) for crop in crops]
+        for name in CROP_PARAMETERS:
+            setattr(
+                self, name, np.array([getattr(crop, name) for crop in crops], dtype)
+            )
+        self.daily_ref_evap_transp = np.array(
+            [soil.daily_ref_evap_transp for soil in soils], dtype
+        )
+        # All solar radiation intercepted by canopy unless set in the crop
+        self.light_intercpt = np.array(
+            [getattr(crop, "light_intercpt", 1) for crop in crops], dtype
+        )
+        self.att_transp = np.array([crop.att_transp for crop in crops], dtype)
+        self.expect_transp = np.array([crop.expect_transp for crop in crops], dtype)
+        self.transp_ratio = np.array([crop.transp_ratio for crop in crops], dtype)
+        self.cum_transp = np.array([crop.cum_transp for crop in crops], dtype)
+        self.cum_pot_transp = np.array([crop.cum_pot_transp for crop in crops], dtype)
+        self.bind()
+
+    @classmethod
+    def from_scenarios(
+        cls, soil, crop, total_scenarios, dtype=np.float64, **parameters
+    ):
+        """Returns an ensemble of copies of one soil and crop pair
+
+        soil: soil instance shared by all scenarios
+        crop: crop instance shared by all scenarios
+        total_scenarios: number of scenarios
+        dtype: float type of the ensemble arrays
+        parameters: values that change between scenarios, with one value
+         (or one row of layer values) per scenario. Any soil sheet layer
+         column (Soil_class.LAYER_COLUMNS, e.g. clay, field_capacity or
+         init_plant_avail_water), crop layer property, crop parameter,
+         daily_ref_evap_transp or light_intercpt. The soil of the scenarios
+         that change layer columns is derived again from them and starts
+         from its initial water content.
+        """
+        soil_inputs = {
+            name: parameters.pop(name)
+            for name in list(parameters)
+            if name in LAYER_COLUMNS
+        }
+        for name in parameters:
+            assert name not in SOIL_LAYER_PROPERTIES, (
+                "%s is derived from the soil layer columns, change them instead" % name
+            )
+        if soil_inputs:
+            soils = scenario_soils(soil, total_scenarios, soil_inputs)
+        else:
+            soils = [soil] * total_scenarios
+        ensemble = cls(soils, [crop] * total_scenarios, dtype)
+        for name, value in parameters.items():
+            current = getattr(ensemble, name)
+            if current.ndim == 2:
+                value = np.broadcast_to(
+                    np.reshape(value, (total_scenarios, -1)), current.shape
+                )
+            current[...] = value
+        ensemble.bind()
+        return ensemble
+
+    def bind(self):
+        """Computes the per-soil constants of the uptake models"""
+        WATER_DENSITY = self.WATER_DENSITY
+        # DSSAT
+        self.dssat_const2 = np.where(
+            self.perm_wilt_point > 0.3, 45, 120 - 250 * self.perm_wilt_point
+        )
+        # EPIC
+        self.epic_depth_dist = 1 - np.exp(
+            -self.water_extraction_dist[:, None] * self.cum_depth
+        )
+        self.epic_dist_total = 1 - np.exp(-self.water_extraction_dist)
+        self.epic_blm = self.perm_wilt_point * self.layer_thickness * WATER_DENSITY
+        self.epic_log_blm = np.log(self.epic_blm)
+        self.epic_log_fc = np.log(
+            self.field_capacity * self.layer_thickness * WATER_DENSITY
+        )
+
+    def set_views(self):
+        """Sets the per layer arrays as views of the layer block"""
+        for index, name in enumerate(LAYER_PROPERTIES):
+            setattr(self, name, self.layer_block[index])
+
+    def copy(self):
+        """Returns an independent copy of the ensemble"""
+        ensemble = Ensemble.__new__(Ensemble)
+        for name, value in self.__dict__.items():
+            if name in LAYER_PROPERTIES:
+                continue
+            if isinstance(value, np.ndarray):
+                value = value.copy()
+            setattr(ensemble, name, value)
+        ensemble.set_views()
+        return ensemble
+
+    def nbytes_per_scenario(self):
+        """Returns the memory of the ensemble arrays per scenario, bytes"""
+        total = sum(
+            value.nbytes
+            for value in vars(self).values()
+            if isinstance(value, np.ndarray) and value.base is None
+        )
+        return total / self.total_scenarios
+
+    def transp_pot(self):
+        """Potential transpiration of each scenario, mm/day"""
+        return self.daily_ref_evap_transp * self.light_intercpt
+
+    def finish_day(self, transp_pot):
+        """Updates the transpiration of all scenarios"""
+        self.att_transp = self.water_uptake.sum(axis=1)  # mm/day
+        self.cum_transp += self.att_transp  # mm
+        self.expect_transp = transp_pot
+        self.cum_pot_transp += self.expect_transp
+        self.transp_ratio = self.att_transp / transp_pot
+
+    def uptake_dssat(self):
+        """DSSAT model water uptake for all scenarios, see Crop"""
+        CONV1 = 1e-4  # convert m/m3 to cm/cm3
+        CONV2 = 100  # convert m to cm
+        CONV3 = 10  # convert cm to mm
+        CONST1 = 1.3e-3
+        CONST3 = 7.01
+        transp_pot = self.transp_pot()
+        root_dens = self.root_dens * CONV1  # cm root / cm3 soil
+        avail_water = self.water_content - self.perm_wilt_point
+        active = (root_dens > 0.00001) & (avail_water > 0)
+        water_uptake = np.where(
+            active,
+            np.minimum(
+                CONST1
+                * np.exp(np.minimum(self.dssat_const2 * avail_water, 40))
+                / (CONST3 - np.log(np.where(active, root_dens, 1))),
+                self.dssat_max_water_uptake[:, None],
+            ),
+            0,
+        )
+        # Water uptake in [mm/d] volume
+        water_uptake = water_uptake * (self.layer_thickness * CONV2) * root_dens * CONV3
+        crop_transp = water_uptake.sum(axis=1)
+        min_transp = np.minimum(transp_pot, crop_transp)
+        scale = np.where(
+            min_transp > 0, min_transp / np.where(min_transp > 0, crop_transp, 1), 0
+        )
+        self.water_uptake[...] = water_uptake * scale[:, None]
+        self.finish_day(transp_pot)
+
+    def uptake_apsim(self):
+        """APSIM model water uptake for all scenarios, see Crop"""
+        transp_pot = self.transp_pot()
+        soil_wat_avail = (
+            (self.water_content - self.perm_wilt_point)
+            * self.layer_thickness
+            * self.WATER_DENSITY
+        )
+        soil_wat_supply = soil_wat_avail * self.kl
+        tot_supply = soil_wat_supply.sum(axis=1)
+        # Water uptake (no supply or demand)
+        no_uptake = (tot_supply <= 0) | (transp_pot <= 0)
+        # Water is not limiting: distribute demand proportionately to supply
+        not_limiting = ~no_uptake & (transp_pot < tot_supply)
+        demand_uptake = (
+            soil_wat_supply
+            / np.where(not_limiting, tot_supply, 1)[:, None]
+            * transp_pot[:, None]
+        )
+        self.water_uptake[...] = np.where(
+            no_uptake[:, None],
+            0,
+            np.where(not_limiting[:, None], demand_uptake, soil_wat_supply),
+        )
+        self.finish_day(transp_pot)
+
+    def uptake_feddes(self):
+        """SWAP/Feddes model water uptake for all scenarios, see Crop"""
+        transp_pot = self.transp_pot()
+        stress_fact = feddes_stress_factor_profile(
+            transp_pot[:, None],
+            self.water_potential,
+            self.P0[:, None],
+            self.field_capacity_water_potential.mean(axis=1)[:, None],
+            self.P2L[:, None],
+            self.P2H[:, None],
+            self.perm_wilt_point_pot.mean(axis=1)[:, None],
+            self.R2H[:, None],
+            self.R2L[:, None],
+        )
+        self.water_uptake[...] = stress_fact * self.root_fraction * transp_pot[:, None]
+        self.finish_day(transp_pot)
+
+    def uptake_wofost(self):
+        """WOFOST model water uptake for all scenarios, see Crop"""
+        DROUGHT_CAT = 4
+        transp_pot = self.transp_pot()
+        p_value = p_wofost(transp_pot, DROUGHT_CAT)
+        # WOFOST does not account for different layers, root fraction is the
+        # layer thickness as if there is only one soil layer
+        self.root_fraction[...] = self.layer_thickness
+        crit_soil_moist = (1 - p_value[:, None]) * (
+            self.field_capacity - self.perm_wilt_point
+        ) + self.perm_wilt_point
+        stress_fact = np.clip(
+            (self.water_content - self.perm_wilt_point)
+            / (crit_soil_moist - self.perm_wilt_point),
+            0,
+            1,
+        )
+        self.water_uptake[...] = stress_fact * self.root_fraction * transp_pot[:, None]
+        self.finish_day(transp_pot)
+
+    def uptake_campbell(self):
+        """CropSyst/Campbell model water uptake for all scenarios, see Crop"""
+        WAT_POT_FIELD_CAP = -33
+        leaf_water_pot_stress_onset = self.leaf_water_pot_stress_onset
+        leaf_water_pot_wilt_point = self.leaf_water_pot_wilt_point
+        leaf_water_pot_range = leaf_water_pot_stress_onset - leaf_water_pot_wilt_point
+
+        # Transpiration
+        pot_transp = self.transp_pot()
+        max_pot_transp = self.campbell_max_daily_transp * self.light_intercpt
+        expect_transp = np.minimum(pot_transp, max_pot_transp)  # mm/day
+
+        # Plant hydraulic conductance (kg s m-4)
+        tot_plant_hydr_cond = max_pot_transp / (
+            WAT_POT_FIELD_CAP - leaf_water_pot_stress_onset
+        )
+        tot_root_hydr_cond = tot_plant_hydr_cond / 0.65
+        tot_shoot_hydr_cond = tot_plant_hydr_cond / 0.35
+        root_cond_adj = self.root_fraction
+        tot_root_cond_adj = root_cond_adj.sum(axis=1)
+        rooted = root_cond_adj > 0
+        root_hydr_cond = tot_root_hydr_cond[:, None] * root_cond_adj
+        shoot_hydr_cond = (
+            tot_shoot_hydr_cond[:, None]
+            * root_cond_adj
+            / np.where(tot_root_cond_adj > 0, tot_root_cond_adj, 1)[:, None]
+        )
+        plant_hydr_cond = np.where(
+            rooted,
+            root_hydr_cond
+            * shoot_hydr_cond
+            / np.where(rooted, root_hydr_cond + shoot_hydr_cond, 1),
+            0,
+        )
+        tot_root_hydr_cond = tot_root_hydr_cond * tot_root_cond_adj
+        tot_plant_hydr_cond = (tot_root_hydr_cond * tot_shoot_hydr_cond) / (
+            tot_root_hydr_cond + tot_shoot_hydr_cond
+        )
+
+        # Leaf water potential
+        conducting = tot_plant_hydr_cond > 0
+        tot_plant_hydr_cond = np.where(conducting, tot_plant_hydr_cond, 1)
+        soil_water_pot_avg = (self.water_potential * root_cond_adj).sum(axis=1)
+        leaf_water_pot = soil_water_pot_avg - expect_transp / tot_plant_hydr_cond
+        leaf_water_pot = np.where(
+            leaf_water_pot < leaf_water_pot_stress_onset,
+            (
+                tot_plant_hydr_cond * soil_water_pot_avg * leaf_water_pot_range
+                + leaf_water_pot_wilt_point * expect_transp
+            )
+            / (tot_plant_hydr_cond * leaf_water_pot_range + expect_transp),
+            leaf_water_pot,
+        )
+        wilted = leaf_water_pot < leaf_water_pot_wilt_point
+        stressed = ~wilted & (leaf_water_pot < leaf_water_pot_stress_onset)
+        leaf_water_pot = np.where(wilted, leaf_water_pot_wilt_point, leaf_water_pot)
+        att_transp = np.where(
+            wilted,
+            0,
+            np.where(
+                stressed,
+                expect_transp
+                * (leaf_water_pot - leaf_water_pot_wilt_point)
+                / leaf_water_pot_range,
+                expect_transp,
+            ),
+        )
+        transp_ratio = np.where(stressed, att_transp / expect_transp, 1)
+        transp_ratio = np.where(wilted, 0, transp_ratio)
+
+        # crop water uptake (kg/m2/d = mm/d), scenarios without plant
+        # conductance keep their previous uptake
+        water_uptake = np.maximum(
+            plant_hydr_cond
+            * (self.water_potential - leaf_water_pot[:, None])
+            * transp_ratio[:, None],
+            0,
+        )
+        self.water_uptake[...] = np.where(
+            conducting[:, None], water_uptake, self.water_uptake
+        )
+        self.att_transp = np.where(conducting, att_transp, self.att_transp)
+        crop_transp = self.water_uptake.sum(axis=1)  # mm/day
+        self.cum_transp += crop_transp
+        self.expect_transp = expect_transp
+        self.cum_pot_transp += expect_transp
+        self.transp_ratio = crop_transp / expect_transp
+
+    def uptake_epic(self):
+        """EPIC model water uptake for all scenarios, see Crop"""
+        CPWU = 0.5
+        TOS = 0
+        SCRP211 = 9
+        SCRP212 = 0.005
+        EP = self.transp_pot()
+        SUM = EP[:, None] * self.epic_depth_dist / self.epic_dist_total[:, None]
+        ST = self.water_content * self.layer_thickness * self.WATER_DENSITY
+        WTN = np.maximum(
+            5,
+            10
+            ** (
+                3.1761
+                - 1.6576
+                * (
+                    (np.log(ST) - self.epic_log_blm)
+                    / (self.epic_log_fc - self.epic_log_blm)
+                )
+            ),
+        )
+        XX = TOS + WTN
+        F = 1 - XX / (XX + np.exp(SCRP211 - SCRP212 * XX))
+        active = XX < 5000
+        avail_water = ST - self.epic_blm
+        # Sequential down the profile, vectorized across scenarios
+        tot_water_uptake = np.zeros(self.total_scenarios)
+        prev_depth_demand = np.zeros(self.total_scenarios)
+        for lyr in range(self.total_layers):
+            uptake = (
+                np.minimum(
+                    SUM[:, lyr]
+                    - CPWU * tot_water_uptake
+                    - (1.0 - CPWU) * prev_depth_demand,
+                    avail_water[:, lyr],
+                )
+                * F[:, lyr]
+            )
+            uptake = np.where(active[:, lyr] & (uptake > 0), uptake, 0)
+            self.water_uptake[:, lyr] = uptake
+            tot_water_uptake += uptake
+            prev_depth_demand = SUM[:, lyr]
+        self.finish_day(EP)
+
+    def update_water_content(self):
+        """Updates soil water content of all scenarios from the water uptake"""
+        self.water_content -= self.water_uptake / (
+            self.layer_thickness * self.WATER_DENSITY
+        )
+        self.water_potential[...] = water_potential(
+            self.porosity, self.air_entry_potential, self.b_value, self.water_content
+        )
+
+    def step(self, model):
+        """Advances all scenarios one day with the given uptake model
+
+        model: one of UPTAKE_MODELS
+        """
+        getattr(self, "uptake_" + model)()
+        self.update_water_content()
+
+    def run(self, model, sim_days, ref_evap_transp=None):
+        """Runs all scenarios for sim_days and returns the daily outputs
+
+        model: one of UPTAKE_MODELS
+        sim_days: number of simulated days
+        ref_evap_transp: (days, scenarios) array of the daily reference
+         evapotranspiration of each scenario, mm/d, instead of a constant one
+
+        Returns a dictionary of (days, scenarios) arrays with the same daily
+        values as the crop attributes of the same name.
+        """
+        assert model in UPTAKE_MODELS, "unknown water uptake model %s" % model
+        outputs = {
+            name: np.zeros((sim_days, self.total_scenarios))
+            for name in [
+                "att_transp",
+                "expect_transp",
+                "transp_ratio",
+                "cum_transp",
+                "cum_pot_transp",
+            ]
+        }
+        for day in range(sim_days):
+            if ref_evap_transp is not None:
+                self.daily_ref_evap_transp[...] = ref_evap_transp[day]
+            self.step(model)
+            for name, values in outputs.items():
+                values[day] = getattr(self, name)
+        return outputs
+
+
+def scenario_soils(soil, total_scenarios, soil_inputs):
+    """Returns the soils of scenarios that change the layer columns of one
+    soil, each derived again from its columns (see Soil_class.build_soils)
+
+    soil_inputs: dictionary of LAYER_COLUMNS names and one value (or one row
+     of layer values) per scenario, in the soil sheet units. The properties
+     given this way are taken as entered manually.
+
+    >>> soil = build_soils({"layer_thickness": [[0.1, 0.2]],
+    ...     "cum_depth": [[0.1, 0.3]], "clay": [[20.0, 30]],
+    ...     "sand": [[40.0, 30]], "kl": [[0.1, 0.1]],
+    ...     "init_plant_avail_water": [[0.5, 0.5]]}, 5)[0]
+    >>> soils = scenario_soils(soil, 3, {"clay": [10, 20, 30]})
+    >>> [round(float(soil.water_potential[0]), 1) for soil in soils]
+    [-133.8, -168.1, -193.7]
+    >>> soils = scenario_soils(soil, 3, {"field_capacity": [0.2, 0.3, 0.45]})
+    >>> [round(float(soil.water_potential[0]), 1) for soil in soils]
+    [-185.8, -154.3, -130.0]
+    """
+    layers = {}
+    for name in LAYER_COLUMNS:
+        if name in soil_inputs:
+            value = np.reshape(soil_inputs[name], (total_scenarios, -1))
+        elif name in MANUAL_PROPERTIES and not getattr(soil, MANUAL_FLAGS[name]):
+            continue
+        elif name in ["clay", "sand"]:
+            value = getattr(soil, name) * 100  # %
+        else:
+            value = getattr(soil, name)
+        layers[name] = np.broadcast_to(value, (total_scenarios, soil.total_layers))
+    return build_soils(layers, soil.daily_ref_evap_transp)
+
+
+def precision_report(soils, crops, sim_days, dtype=np.float32, models=UPTAKE_MODELS):
+    """Returns the deviation of a reduced precision ensemble from float64
+
+    soils, crops: scenarios, see Ensemble
+    sim_days: number of simulated days
+    dtype: reduced float type
+
+    Returns a dictionary with, for each model, the largest relative
+    deviation of the cumulative transpiration and the largest absolute
+    deviation of the water content (m3/m3) on the last day, and the
+    bytes_per_scenario of both ensembles
+    """
+    reference = Ensemble(soils, crops)
+    reduced = Ensemble(soils, crops, dtype)
+    report = {
+        "bytes_per_scenario": (
+            reference.nbytes_per_scenario(),
+            reduced.nbytes_per_scenario(),
+        )
+    }
+    for model in models:
+        expected = reference.copy()
+        actual = reduced.copy()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            expected_cum = expected.run(model, sim_days)["cum_transp"][-1]
+            actual_cum = actual.run(model, sim_days)["cum_transp"][-1]
+        report[model] = {
+            "cum_transp": float(
+                (
+                    np.abs(actual_cum - expected_cum)
+                    / np.maximum(np.abs(expected_cum), 1e-12)
+                ).max()
+            ),
+            "water_content": float(
+                np.abs(actual.water_content - expected.water_content).max()
+            ),
+        }
+    return report
@@ -2,120 +2,322 @@
     APSIM, CropSyst, DSSAT, EPIC, SWAP and WOFOST simulation models """
 #!/usr/bin/env python
 from __future__ import division
-from xlrd import open_workbook
-from Crop_class import Crop
-from Soil_class import Soil
-from Print_class import PrintOutput
+import argparse
+import calendar
+import os
+from contextlib import nullcontext
+import numpy as np
+from Crop_class import UPTAKE_MODELS
+from inputs import CACHE_DIR, load_inputs
+from jit_backend import use_jit
+from Print_class import ResultsRecorder, StreamingOutput
+from profiling import StageProfiler
+from weather import CACHE_DIR as WEATHER_CACHE_DIR
+from weather import daily_ref_evap_transp, load_weather, sim_day_values
 
 
-def main():
-    # Control initialization
-    book = open_workbook("sim_data.xls")  # Input data
-    sheet_inputs = book.sheet_by_name("inputs")
-    start_day = int(sheet_inputs.cell(2, 1).value)
-    end_day = int(sheet_inputs.cell(3, 1).value)
-    start_year = int(sheet_inputs.cell(4, 1).value)
-    end_year = int(sheet_inputs.cell(5, 1).value)
-    sim_length = 366 - start_day + (end_year - start_year) * 366
-
-    # Soil initialization
-    soil_campbell = Soil(book)
-    soil_dssat = Soil(book)
-    soil_apsim = Soil(book)
-    soil_feddes = Soil(book)
-    soil_epic = Soil(book)
-    soil_wofost = Soil(book)
-
-    # Crops initialization
-    crop_campbell = Crop(1, sim_length, book, soil_campbell)
-    crop_dssat = Crop(1, sim_length, book, soil_dssat)
-    crop_apsim = Crop(1, sim_length, book, soil_apsim)
-    crop_feddes = Crop(1, sim_length, book, soil_feddes)
-    crop_epic = Crop(1, sim_length, book, soil_epic)
-    crop_wofost = Crop(1, sim_length, book, soil_wofost)
-    crop_list = [
-        crop_campbell,
-        crop_dssat,
-        crop_apsim,
-        crop_feddes,
-        crop_epic,
-        crop_wofost,
-    ]
-
-    # Print initialization
-    print_outputs_campbell = PrintOutput(soil_campbell)
-    print_outputs_dssat = PrintOutput(soil_dssat)
-    print_outputs_apsim = PrintOutput(soil_apsim)
-    print_outputs_feddes = PrintOutput(soil_feddes)
-    print_outputs_epic = PrintOutput(soil_epic)
-    print_outputs_wofost = PrintOutput(soil_wofost)
-
-    # Start simulation
-    new_year = start_year
-    day_of_year = start_day
-    sim_day = 1
-
-    # All solar radiation intercepted by canopy
-    crop_campbell.light_intercpt = 1
-    crop_dssat.light_intercpt = 1
-    crop_apsim.light_intercpt = 1
-    crop_feddes.light_intercpt = 1
-    crop_epic.light_intercpt = 1
-    crop_wofost.light_intercpt = 1
+# Output file name of each model
+OUTPUT_NAMES = {
+    "campbell": "campbell_output",
+    "dssat": "DSSAT_output",
+    "apsim": "APSIM_output",
+    "feddes": "feddes_output",
+    "epic": "epic_output",
+    "wofost": "wofost_output",
+}
 
-    while True:
-        # Water uptake
-        for crop in crop_list:
-            if crop == crop_campbell:
-                crop.water_uptake_campbell(soil_campbell)
-            if crop == crop_dssat:
-                crop.water_uptake_dssat(soil_dssat)
-            if crop == crop_apsim:
-                crop.water_uptake_apsim(soil_apsim)
-            if crop == crop_feddes:
-                crop.water_uptake_feddes(soil_feddes)
-            if crop == crop_epic:
-                crop.water_uptake_epic(soil_epic)
-            if crop == crop_wofost:
-                crop.water_uptake_wofost(soil_wofost)
-
-        # Update soil water content
-        soil_campbell.update_water_content([crop_campbell])
-        soil_dssat.update_water_content([crop_dssat])
-        soil_apsim.update_water_content([crop_apsim])
-        soil_feddes.update_water_content([crop_feddes])
-        soil_epic.update_water_content([crop_epic])
-        soil_wofost.update_water_content([crop_wofost])
-
-        # Print outputs
-        print_outputs_campbell.daily(
-            sim_day, new_year, day_of_year, crop_campbell, soil_campbell
+
+class ModelRun(object):
+    """Soil, crop and outputs of one water uptake model"""
+
+    def __init__(self, model, sim_inputs, output_dir, chunk_size):
+        assert model in UPTAKE_MODELS, "unknown water uptake model %s" % model
+        self.model = model
+        self.output_name = OUTPUT_NAMES.get(model, model + "_output")
+        # Kernel looked up once for the whole simulation
+        self.water_uptake = UPTAKE_MODELS[model]
+        self.soil = sim_inputs.soil_spec.fresh_state()
+        self.crop = sim_inputs.crop_spec.fresh_state()
+        # All solar radiation intercepted by canopy
+        self.crop.light_intercpt = 1
+        # Day the model stopped taking up water
+        self.idle_day = None
+        self.output = new_output(
+            self.soil, sim_inputs.sim_length, output_dir, self.output_name, chunk_size
         )
-        print_outputs_dssat.daily(
-            sim_day, new_year, day_of_year, crop_dssat, soil_dssat
+
+
+def simulate(
+    sim_inputs,
+    output_dir=".",
+    chunk_size=None,
+    models=None,
+    skip_idle=True,
+    profiler=None,
+    ref_evap_transp=None,
+):
+    """Runs the selected water uptake models
+
+    sim_inputs: parsed simulation inputs (see inputs.load_inputs)
+    output_dir: folder of the output spreadsheets, not saved if None
+    chunk_size: if given, outputs are streamed to csv files in chunks of
+     chunk_size days instead of being saved in spreadsheets at the end
+    models: names of the UPTAKE_MODELS to run (default: all of them)
+    skip_idle: stop simulating a model once its soil water no longer
+     changes, its remaining days repeat the same day and are filled at once
+    profiler: profiling.StageProfiler timing the stages of each model
+    ref_evap_transp: reference evapotranspiration of each simulation day,
+     mm/d, instead of the constant one of the soil (see weather). Models
+     are not skipped when idle if it changes from day to day.
+
+    Returns the cumulative transpiration of each model
+    """
+    if models is None:
+        models = list(UPTAKE_MODELS)
+    years, days_of_year = sim_calendar(sim_inputs)
+    sim_days = np.arange(1, len(years) + 1)
+    if ref_evap_transp is None:
+        daily_demand = [None] * len(sim_days)
+    else:
+        assert len(ref_evap_transp) >= len(sim_days), "missing weather days"
+        daily_demand = ref_evap_transp[: len(sim_days)].tolist()
+        # An idle day is no longer repeated when the demand changes
+        skip_idle = skip_idle and len(set(daily_demand)) == 1
+
+    # Soil and crop of each model are copies of the parsed inputs
+    runs = []
+    try:
+        for model in models:
+            runs.append(ModelRun(model, sim_inputs, output_dir, chunk_size))
+            if profiler is not None:
+                profiler.instrument(runs[-1])
+        run_days(runs, sim_days, years, days_of_year, daily_demand, skip_idle)
+        # Save excel files
+        if output_dir is not None:
+            for run in runs:
+                run.output.save_data(os.path.join(output_dir, run.output_name + ".xls"))
+    finally:
+        # Streamed outputs are closed even if a run fails
+        for run in runs:
+            run.output.close()
+
+    return {run.model: summary(run.crop, len(sim_days)) for run in runs}
+
+
+def run_days(runs, sim_days, years, days_of_year, daily_demand, skip_idle):
+    """Simulates the days of the model runs, see simulate
+
+    daily_demand: reference evapotranspiration of each day, None for the
+     constant one of the soil
+    """
+    active_runs = list(runs)
+    for sim_day, new_year, day_of_year, demand in zip(
+        sim_days.tolist(), years.tolist(), days_of_year.tolist(), daily_demand
+    ):
+        if not active_runs:
+            break  # every model is idle
+        for run in active_runs:
+            if demand is not None:
+                run.soil.daily_ref_evap_transp = demand
+            if skip_idle:
+                water_content = run.soil.water_content.copy()
+            # Water uptake
+            run.water_uptake(run.crop, run.soil)
+            # Update soil water content
+            run.soil.update_water_content([run.crop])
+            # Print outputs
+            run.output.daily(sim_day, new_year, day_of_year, run.crop, run.soil)
+            if skip_idle and np.array_equal(water_content, run.soil.water_content):
+                # Zero flux, or an uptake too small to change the water
+                # content: every following day repeats this one
+                run.idle_day = sim_day
+        active_runs = [run for run in active_runs if run.idle_day is None]
+
+    for run in runs:
+        if run.idle_day is not None and run.idle_day < len(sim_days):
+            fill_idle_days(run, sim_days, years, days_of_year)
+
+
+def sim_calendar(sim_inputs):
+    """Returns the year and day of year of each simulation day, the last one
+    is the day before end_day of end_year"""
+    years = []
+    days_of_year = []
+    new_year = sim_inputs.start_year
+    day_of_year = sim_inputs.start_day
+    while True:
+        years.append(new_year)
+        days_of_year.append(day_of_year)
+        day_of_year += 1
+        if day_of_year > 365 + calendar.isleap(new_year):
+            new_year += 1
+            day_of_year = 1
+        if new_year == sim_inputs.end_year and day_of_year == sim_inputs.end_day:
+            return np.array(years), np.array(days_of_year)
+
+
+def fill_idle_days(run, sim_days, years, days_of_year):
+    """Fills the outputs of the days after a model went idle
+
+    Only the cumulative transpiration changes, it is accumulated one day at
+    a time as in the daily loop.
+    """
+    first = run.idle_day
+    idle_days = len(sim_days) - first
+    cum_transp = accumulate(run.crop.cum_transp, run.crop.water_uptake.sum(), idle_days)
+    cum_pot_transp = accumulate(
+        run.crop.cum_pot_transp, run.crop.expect_transp, idle_days
+    )
+    run.crop.cum_transp = cum_transp[-1].item()
+    run.crop.cum_pot_transp = cum_pot_transp[-1].item()
+    run.output.fill(
+        first,
+        sim_days[first:],
+        years[first:],
+        days_of_year[first:],
+        run.crop,
+        run.soil,
+        cum_transp,
+        cum_pot_transp,
+    )
+
+
+def accumulate(total, daily, days):
+    """Returns the running total of a daily value, added one day at a time
+
+    >>> accumulate(1.0, 0.1, 3)
+    array([1.1, 1.2, 1.3])
+    """
+    return np.add.accumulate(np.append(total, np.full(days, daily)))[1:]
+
+
+def new_output(soil, sim_length, output_dir, fname, chunk_size):
+    """Returns the daily output of a model, streamed to csv files when a
+    chunk size is given"""
+    if chunk_size and output_dir is not None:
+        return StreamingOutput(soil, os.path.join(output_dir, fname), chunk_size)
+    return ResultsRecorder(soil, sim_length)
+
+
+def summary(crop, sim_days):
+    """Returns the season totals of a crop"""
+    return {
+        "sim_days": sim_days,
+        "cum_transp": crop.cum_transp,
+        "cum_pot_transp": crop.cum_pot_transp,
+        "transp_ratio": crop.cum_transp / crop.cum_pot_transp,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "input_file",
+        nargs="?",
+        default="sim_data.xls",
+        help="input workbook, JSON or TOML file (default: sim_data.xls)",
+    )
+    parser.add_argument(
+        "--models",
+        type=lambda text: text.split(","),
+        default=None,
+        help="comma separated models to run (default: all)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="do not cache the parsed inputs and the results",
+    )
+    parser.add_argument(
+        "--result-cache-size",
+        type=float,
+        default=500,
+        help="MB of results kept in the cache (default: 500)",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=None,
+        help="stream outputs to csv files every CHUNK_SIZE days",
+    )
+    parser.add_argument(
+        "--no-jit",
+        action="store_true",
+        help="run the reference kernels even if Numba is installed",
+    )
+    parser.add_argument(
+        "--no-skip-idle",
+        action="store_true",
+        help="simulate every day even after a model stops taking up water",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="print the time spent in each stage of each model",
+    )
+    parser.add_argument(
+        "--profile-json", help="save the stage times in a JSON file (implies --profile)"
+    )
+    parser.add_argument(
+        "--profile-trace",
+        help="save the timed calls in a Chrome trace file (implies --profile)",
+    )
+    parser.add_argument(
+        "--weather",
+        help="daily weather csv file, the reference evapotranspiration of "
+        "each day replaces the constant one of the soil sheet",
+    )
+    parser.add_argument("--latitude", type=float, help="weather site latitude, degrees")
+    parser.add_argument("--elevation", type=float, help="weather site elevation, m")
+    args = parser.parse_args()
+    profiler = None
+    if args.profile or args.profile_json or args.profile_trace:
+        profiler = StageProfiler()
+    # Compiled kernels when Numba is available
+    use_jit(not args.no_jit)
+    with profiler.timer("all", "load_inputs") if profiler else nullcontext():
+        sim_inputs = load_inputs(  # Input data
+            args.input_file, cache_dir=None if args.no_cache else CACHE_DIR
         )
-        print_outputs_apsim.daily(
-            sim_day, new_year, day_of_year, crop_apsim, soil_apsim
+    ref_evap_transp = None
+    if args.weather:
+        weather = load_weather(
+            args.weather, cache_dir=None if args.no_cache else WEATHER_CACHE_DIR
         )
-        print_outputs_feddes.daily(
-            sim_day, new_year, day_of_year, crop_feddes, soil_feddes
+        years, days_of_year = sim_calendar(sim_inputs)
+        ref_evap_transp = sim_day_values(
+            weather,
+            daily_ref_evap_transp(weather, args.latitude, args.elevation),
+            years,
+            days_of_year,
         )
-        print_outputs_epic.daily(sim_day, new_year, day_of_year, crop_epic, soil_epic)
-        print_outputs_wofost.daily(
-            sim_day, new_year, day_of_year, crop_wofost, soil_wofost
+    if args.no_cache or profiler is not None:
+        simulate(
+            sim_inputs,
+            chunk_size=args.chunk_size,
+            models=args.models,
+            skip_idle=not args.no_skip_idle,
+            profiler=profiler,
+            ref_evap_transp=ref_evap_transp,
         )
-        sim_day += 1  # New simulation day
-        day_of_year += 1
+    else:
+        # Identical runs copy the outputs of the first one
+        from result_cache import cached_simulate
 
-        # Save excel files and end simulation
-        if new_year == end_year and day_of_year == end_day:
-            print_outputs_campbell.save_data("campbell_output.xls")
-            print_outputs_dssat.save_data("DSSAT_output.xls")
-            print_outputs_apsim.save_data("APSIM_output.xls")
-            print_outputs_feddes.save_data("feddes_output.xls")
-            print_outputs_epic.save_data("epic_output.xls")
-            print_outputs_wofost.save_data("wofost_output.xls")
-            break  # end of simulation
+        cached_simulate(
+            sim_inputs,
+            chunk_size=args.chunk_size,
+            models=args.models,
+            skip_idle=not args.no_skip_idle,
+            ref_evap_transp=ref_evap_transp,
+            max_bytes=int(args.result_cache_size * 1024**2),
+        )
+    if profiler is not None:
+        print(profiler.summary())
+        if args.profile_json:
+            profiler.save_json(args.profile_json)
+        if args.profile_trace:
+            profiler.save_trace(args.profile_trace)
 
 
 if __name__ == "__main__":
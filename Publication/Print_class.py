@@ -1,6 +1,89 @@
 """Prints water uptake and water stress results in a spreadsheet"""
+import os
+import numpy as np
 from xlwt import Workbook
 
+CROP_HEADERS = [
+    "sim_day",
+    "Year",
+    "DOY",
+    "",
+    "Transpiration",
+    "Potential Transp.",
+    "Transp.Ratio",
+    "Cum.Transp.",
+    "Cum.Pot.Transp.",
+]
+SOIL_HEADERS = [
+    "sim_day",
+    "Year",
+    "DOY",
+    "Runoff",
+    "Infiltration",
+    "Drainage",
+    "Soil evaporation",
+]
+
+# Columns of an xls sheet, wider tables continue on more sheets
+MAX_COLUMNS = 256
+
+
+def soil_headers(total_layers):
+    """Returns the soil output headers of a soil profile
+
+    >>> soil_headers(2)[7:]
+    ['Layer 1 WC', 'Layer 2 WC', 'Layer 1 WP', 'Layer 2 WP']
+    """
+    headers = list(SOIL_HEADERS)
+    for i in range(1, total_layers + 1):
+        headers.append("Layer %d WC" % i)
+    for i in range(1, total_layers + 1):
+        headers.append("Layer %d WP" % i)
+    return headers
+
+
+def column_blocks(total_columns, max_columns=MAX_COLUMNS):
+    """Returns the columns written on each sheet of a table, the sheets after
+    the first repeat the sim_day, Year and DOY columns
+
+    >>> [len(cols) for cols in column_blocks(600)]
+    [256, 256, 94]
+    """
+    blocks = [list(range(min(total_columns, max_columns)))]
+    col = len(blocks[0])
+    while col < total_columns:
+        end = min(total_columns, col + max_columns - 3)
+        blocks.append([0, 1, 2] + list(range(col, end)))
+        col = end
+    return blocks
+
+
+def sheet_name(name, block):
+    """Returns the name of a sheet of a table: soil, soil 2, soil 3..."""
+    return name if block == 0 else "%s %d" % (name, block + 1)
+
+
+def read_soil_results(book):
+    """Returns the water content and water potential of each day and layer
+    of an output workbook, as (days, layers) arrays
+
+    book: xlrd workbook saved by PrintOutput or ResultsRecorder
+    """
+    columns = {}
+    block = 0
+    while sheet_name("soil", block) in book.sheet_names():
+        sheet = book.sheet_by_name(sheet_name("soil", block))
+        for col, header in enumerate(sheet.row_values(0)):
+            columns[header] = sheet.col_values(col, 1)
+        block += 1
+    total_layers = (len(columns) - len(SOIL_HEADERS)) // 2
+    return [
+        np.array(
+            [columns["Layer %d %s" % (lyr, name)] for lyr in range(1, total_layers + 1)]
+        ).T
+        for name in ["WC", "WP"]
+    ]
+
 
 class PrintOutput(object):
     """Create a print class"""
@@ -10,35 +93,13 @@ class PrintOutput(object):
         # Crop headers
         self.crop_out = self.book_out.add_sheet("crop")
         # self.crop_out2 = self.book_out.add_sheet('crop 2')
-        self.crop_headers = [
-            "sim_day",
-            "Year",
-            "DOY",
-            "",
-            "Transpiration",
-            "Potential Transp.",
-            "Transp.Ratio",
-            "Cum.Transp.",
-            "Cum.Pot.Transp.",
-        ]
+        self.crop_headers = CROP_HEADERS
         FIRST_ROW = 0
         for i in range(len(self.crop_headers)):
             self.crop_out.write(FIRST_ROW, i, self.crop_headers[i])
         # Soil headers in excel output
         self.soil_out = self.book_out.add_sheet("soil")
-        self.soil_headers = [
-            "sim_day",
-            "Year",
-            "DOY",
-            "Runoff",
-            "Infiltration",
-            "Drainage",
-            "Soil evaporation",
-        ]
-        for i in range(1, soil.total_layers + 1):
-            self.soil_headers.append("Layer %d WC" % i)
-        for i in range(1, soil.total_layers + 1):
-            self.soil_headers.append("Layer %d WP" % i)
+        self.soil_headers = soil_headers(soil.total_layers)
         for i in range(len(self.soil_headers)):
             self.soil_out.write(FIRST_ROW, i, self.soil_headers[i])
 
@@ -75,3 +136,197 @@ class PrintOutput(object):
 
     def save_data(self, fname):
         self.book_out.save(fname)
+
+
+class ResultsRecorder(object):
+    """Records the daily results in preallocated arrays, saved at the end
+
+    Same outputs as PrintOutput, with one row filled per day instead of
+    writing every cell of the spreadsheet.
+    """
+
+    def __init__(self, soil, sim_length):
+        self.crop_headers = CROP_HEADERS
+        self.soil_headers = soil_headers(soil.total_layers)
+        self.total_layers = soil.total_layers
+        self.crop = np.zeros((sim_length, len(self.crop_headers)))
+        self.soil = np.zeros((sim_length, len(self.soil_headers)))
+        self.rows = 0
+
+    def daily(self, sim_day, year, doy, crop, soil):
+        self.record(sim_day - 1, sim_day, year, doy, crop, soil)
+
+    def record(self, row, sim_day, year, doy, crop, soil):
+        """Fills one row of results"""
+        if row >= len(self.crop):
+            # Simulation longer than expected
+            self.crop = np.vstack([self.crop, np.zeros_like(self.crop)])
+            self.soil = np.vstack([self.soil, np.zeros_like(self.soil)])
+        self.crop[row] = (
+            sim_day,
+            year,
+            doy,
+            0,
+            crop.att_transp,
+            crop.expect_transp,
+            crop.transp_ratio,
+            crop.cum_transp,
+            crop.cum_pot_transp,
+        )
+        self.soil[row, :3] = (sim_day, year, doy)
+        self.soil[row, 7 : 7 + self.total_layers] = soil.water_content
+        self.soil[row, 7 + self.total_layers :] = soil.water_potential
+        self.rows = max(self.rows, row + 1)
+
+    def fill(self, row, sim_days, years, doys, crop, soil, cum_transp, cum_pot_transp):
+        """Fills the rows of days that repeat the state of the crop and soil
+
+        row: first row to fill
+        sim_days, years, doys: arrays with the dates of the rows
+        cum_transp, cum_pot_transp: arrays with the cumulative transpiration
+         of the rows, the only outputs that still change
+        """
+        end = row + len(sim_days)
+        self.record(end - 1, sim_days[-1], years[-1], doys[-1], crop, soil)
+        self.crop[row:end] = self.crop[end - 1]
+        self.soil[row:end] = self.soil[end - 1]
+        for values in [self.crop, self.soil]:
+            values[row:end, 0] = sim_days
+            values[row:end, 1] = years
+            values[row:end, 2] = doys
+        self.crop[row:end, 7] = cum_transp
+        self.crop[row:end, 8] = cum_pot_transp
+
+    def save_data(self, fname):
+        """Saves the results in a spreadsheet with the PrintOutput layout
+
+        Soil profiles with more than 124 layers continue on the soil 2, soil
+        3... sheets (see column_blocks).
+        """
+        book_out = Workbook(encoding="utf-8")
+        FIRST_ROW = 0
+        for name, headers, values, skip_cols in [
+            ("crop", self.crop_headers, self.crop, [3]),
+            ("soil", self.soil_headers, self.soil, []),
+        ]:
+            rows = values[: self.rows].tolist()
+            for block, block_cols in enumerate(column_blocks(len(headers))):
+                sheet = book_out.add_sheet(sheet_name(name, block))
+                for sheet_col, col in enumerate(block_cols):
+                    sheet.write(FIRST_ROW, sheet_col, headers[col])
+                cols = [
+                    (sheet_col, col)
+                    for sheet_col, col in enumerate(block_cols)
+                    if col not in skip_cols
+                ]
+                for row, row_values in enumerate(rows, 1):
+                    for sheet_col, col in cols:
+                        sheet.write(row, sheet_col, row_values[col])
+        book_out.save(fname)
+
+    def save_npz(self, fname):
+        """Saves the results in a numpy binary file"""
+        np.savez(
+            fname,
+            crop=self.crop[: self.rows],
+            crop_headers=self.crop_headers,
+            soil=self.soil[: self.rows],
+            soil_headers=self.soil_headers,
+        )
+
+    def close(self):
+        """Nothing to release, the results are kept in memory"""
+
+
+class StreamingOutput(object):
+    """Writes the daily results to csv files in chunks of days
+
+    Only one chunk of rows is kept in memory, so memory use does not grow
+    with the simulation length. The files are fname_crop.csv and
+    fname_soil.csv.
+
+    soil: soil class with properties
+    fname: output file name without extension
+    chunk_size: number of days kept in memory before writing them
+    """
+
+    def __init__(self, soil, fname, chunk_size=365):
+        self.recorder = ResultsRecorder(soil, chunk_size)
+        self.chunk_size = chunk_size
+        # The blank crop column of the spreadsheet is left out
+        self.crop_cols = [
+            col for col, header in enumerate(self.recorder.crop_headers) if header
+        ]
+        self.fname = fname
+        self.crop_file = open(fname + "_crop.csv", "w")
+        try:
+            self.soil_file = open(fname + "_soil.csv", "w")
+        except OSError:
+            self.crop_file.close()
+            raise
+        self.crop_file.write(
+            ",".join(self.recorder.crop_headers[col] for col in self.crop_cols) + "\n"
+        )
+        self.soil_file.write(",".join(self.recorder.soil_headers) + "\n")
+
+    def daily(self, sim_day, year, doy, crop, soil):
+        if self.recorder.rows == self.chunk_size:
+            self.flush()
+        self.recorder.record(self.recorder.rows, sim_day, year, doy, crop, soil)
+
+    def fill(self, row, sim_days, years, doys, crop, soil, cum_transp, cum_pot_transp):
+        """Writes the rows of days that repeat the state of the crop and soil,
+        see ResultsRecorder.fill
+
+        row: not used, the rows follow the last written day
+        """
+        start = 0
+        while start < len(sim_days):
+            if self.recorder.rows == self.chunk_size:
+                self.flush()
+            end = min(len(sim_days), start + self.chunk_size - self.recorder.rows)
+            self.recorder.fill(
+                self.recorder.rows,
+                sim_days[start:end],
+                years[start:end],
+                doys[start:end],
+                crop,
+                soil,
+                cum_transp[start:end],
+                cum_pot_transp[start:end],
+            )
+            start = end
+
+    def flush(self):
+        """Writes the rows of the current chunk"""
+        rows = self.recorder.rows
+        np.savetxt(
+            self.crop_file,
+            self.recorder.crop[:rows, self.crop_cols],
+            fmt="%.17g",
+            delimiter=",",
+        )
+        np.savetxt(
+            self.soil_file, self.recorder.soil[:rows], fmt="%.17g", delimiter=","
+        )
+        self.recorder.rows = 0
+
+    def save_data(self, fname=None):
+        """Writes the remaining rows and closes the files
+
+        fname: output file name, the csv files are moved to its name without
+         extension when it differs from the one they were created with
+        """
+        self.flush()
+        self.close()
+        if fname is not None:
+            new_fname = os.path.splitext(fname)[0]
+            if new_fname != self.fname:
+                for suffix in ["_crop.csv", "_soil.csv"]:
+                    os.replace(self.fname + suffix, new_fname + suffix)
+                self.fname = new_fname
+
+    def close(self):
+        """Closes the csv files, the rows not yet written are dropped"""
+        self.crop_file.close()
+        self.soil_file.close()
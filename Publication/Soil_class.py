@@ -1,6 +1,7 @@
 """Module to create soil classes for each water uptake simulation module"""
 #!/usr/bin/env python
 from __future__ import division
+import copy
 import numpy as np
 from functions import (
     bulk_density,
@@ -15,158 +16,286 @@ from functions import (
 )
 
 
+# Layer columns of the soil sheet
+LAYER_COLUMNS = {
+    "layer_thickness": 1,  # m
+    "cum_depth": 2,  # m
+    "clay": 3,  # %
+    "sand": 4,  # %
+    "organic_matter": 5,  # %
+    "bulk_density": 6,  # Mg/m3
+    "field_capacity": 7,  # m3/m3
+    "perm_wilt_point": 8,  # m3/m3
+    "kl": 11,  # cm2 / day
+    "init_plant_avail_water": 12,  # fraction
+}
+# Crop root columns of the soil sheet, read by the crop
+ROOT_COLUMNS = {
+    "root_dens": 9,  # m/m3
+    "root_fraction": 10,  # m/m
+}
+# Layer properties derived from texture unless they are given
+MANUAL_PROPERTIES = [
+    "organic_matter",
+    "bulk_density",
+    "field_capacity",
+    "perm_wilt_point",
+]
+
+
+def soil_properties(layers):
+    """Returns the hydraulic properties and initial water of soil layers
+
+    layers: dictionary of LAYER_COLUMNS arrays in the soil sheet units, all
+     of the same shape, e.g. (profiles, layers) for a soil database. The
+     MANUAL_PROPERTIES missing from it are derived from texture.
+
+    Returns a dictionary of arrays with the shape of the layers, except for
+    mean_field_capacity that has one value per profile
+
+    >>> props = soil_properties({"layer_thickness": np.array([0.1, 0.2]),
+    ...     "cum_depth": np.array([0.1, 0.3]), "clay": np.array([20.0, 30]),
+    ...     "sand": np.array([40.0, 30]), "kl": np.array([0.1, 0.1]),
+    ...     "init_plant_avail_water": np.array([1.0, 0.5])})
+    >>> props["field_capacity"].round(4)
+    array([0.2774, 0.3342])
+    >>> round(float(props["mean_field_capacity"]), 4)
+    0.3152
+    """
+    PERMNT_WILT_POINT_WP = -1500  # J/kg
+    WATER_DENSITY = 1000  # kg/m3
+    props = {
+        name: np.asarray(layers[name], dtype=float)
+        for name in LAYER_COLUMNS
+        if name in layers
+    }
+    clay = props["clay"] / 100
+    sand = props["sand"] / 100
+    if "organic_matter" not in props:
+        props["organic_matter"] = organic_m(clay)
+    organic_matter = props["organic_matter"]
+    if "bulk_density" not in props:
+        props["bulk_density"] = bulk_density(clay, sand, organic_matter)
+    porosity = sat_water_content(props["bulk_density"])
+    manual_field_capacity = "field_capacity" in props
+    if not manual_field_capacity:
+        props["field_capacity"] = vol_water_content_33_j_kg(clay, sand, organic_matter)
+    manual_permanent_wilt_point = "perm_wilt_point" in props
+    if not manual_permanent_wilt_point:
+        props["perm_wilt_point"] = vol_water_content_1500_jkg(
+            clay, sand, organic_matter
+        )
+    campbell_b = b_value(props["field_capacity"], props["perm_wilt_point"])
+    air_entry_potential = air_entry_pot(props["field_capacity"], porosity, campbell_b)
+    if manual_field_capacity:
+        field_capacity_water_potential = water_potential(
+            porosity, air_entry_potential, campbell_b, props["field_capacity"]
+        )
+    else:
+        field_capacity_water_potential = -0.35088 * clay * 100 - 28.947  # needs ref
+        # calculated again using more accurate formula
+        props["field_capacity"] = water_content(
+            porosity, air_entry_potential, campbell_b, field_capacity_water_potential
+        )
+    if not manual_permanent_wilt_point:
+        # calculated again using more accurate formula
+        props["perm_wilt_point"] = water_content(
+            porosity, air_entry_potential, campbell_b, PERMNT_WILT_POINT_WP
+        )
+    field_capacity = props["field_capacity"]
+    perm_wilt_point = props["perm_wilt_point"]
+    assert np.all(
+        perm_wilt_point < field_capacity
+    ), "Permanent wilting point must be less than field capacity"
+    plant_avail_water = field_capacity - perm_wilt_point
+    init_water_content = (
+        props["init_plant_avail_water"] * plant_avail_water + perm_wilt_point
+    )
+    layer_thickness = props["layer_thickness"]
+    props.update(
+        clay=clay,
+        sand=sand,
+        porosity=porosity,
+        b_value=campbell_b,
+        air_entry_potential=air_entry_potential,
+        field_capacity_water_potential=field_capacity_water_potential,
+        plant_avail_water=plant_avail_water,
+        water_content=init_water_content,
+        init_water_avail=(init_water_content - perm_wilt_point)
+        * layer_thickness
+        * WATER_DENSITY,
+        water_potential=water_potential(
+            porosity, air_entry_potential, campbell_b, init_water_content
+        ),
+        perm_wilt_point_pot=water_potential(
+            porosity, air_entry_potential, campbell_b, perm_wilt_point
+        ),
+        sat_water_potential=water_potential(
+            porosity, air_entry_potential, campbell_b, porosity
+        ),
+        mean_field_capacity=(field_capacity * layer_thickness).sum(axis=-1)
+        / layer_thickness.sum(axis=-1),
+    )
+    return props
+
+
+def build_soils(layers, daily_ref_evap_transp):
+    """Returns the soils of a soil database, derived in one pass
+
+    layers: dictionary of LAYER_COLUMNS arrays shaped (profiles, layers) in
+     the soil sheet units, MANUAL_PROPERTIES are derived from texture when
+     missing
+    daily_ref_evap_transp: reference evapotranspiration, mm/d, one value or
+     one value per profile
+    """
+    props = soil_properties(layers)
+    total_profiles = props["clay"].shape[0]
+    daily_ref_evap_transp = np.broadcast_to(daily_ref_evap_transp, total_profiles)
+    manual = {name: name in layers for name in MANUAL_PROPERTIES}
+    return [
+        Soil.from_properties(
+            {name: value[profile] for name, value in props.items()},
+            daily_ref_evap_transp[profile],
+            manual,
+        )
+        for profile in range(total_profiles)
+    ]
+
+
 class Soil(object):
     """create a soil instance"""
 
     def __init__(self, book):
-        PERMNT_WILT_POINT_WP = -1500  # J/kg
-        self.WATER_DENSITY = 1000  # kg/m3
         sheet_soil = book.sheet_by_name("soil")
-        self.total_layers = int(sheet_soil.cell(4, 2).value)
+        total_layers = int(sheet_soil.cell(4, 2).value)
+        manual = {
+            "organic_matter": sheet_soil.cell(5, 5).value,
+            "bulk_density": sheet_soil.cell(5, 6).value,
+            "field_capacity": sheet_soil.cell(5, 7).value,
+            "perm_wilt_point": sheet_soil.cell(5, 8).value,
+        }
+        # Layer columns, measured properties only if switched on
+        layers = {
+            name: [sheet_soil.cell(9 + lyr, col).value for lyr in range(total_layers)]
+            for name, col in LAYER_COLUMNS.items()
+            if name not in manual or manual[name]
+        }
+        self.set_properties(
+            soil_properties(layers), int(sheet_soil.cell(5, 2).value), manual
+        )
+
+    @classmethod
+    def from_properties(cls, props, daily_ref_evap_transp, manual):
+        """Returns a soil with the properties of soil_properties
+
+        props: soil_properties of one profile
+        daily_ref_evap_transp: reference evapotranspiration, mm/d
+        manual: MANUAL_PROPERTIES flags, true for the given properties
+        """
+        soil = cls.__new__(cls)
+        soil.set_properties(props, daily_ref_evap_transp, manual)
+        return soil
+
+    def set_properties(self, props, daily_ref_evap_transp, manual):
+        """Sets the soil arrays from the soil_properties of one profile"""
+        self.WATER_DENSITY = 1000  # kg/m3
+        self.total_layers = len(props["layer_thickness"])
         self.layers = range(self.total_layers)
-        self.daily_ref_evap_transp = int(sheet_soil.cell(5, 2).value)
-        self.manual_organic_matter = sheet_soil.cell(5, 5).value
-        self.manual_bulk_density = sheet_soil.cell(5, 6).value
-        self.manual_field_capacity = sheet_soil.cell(5, 7).value
-        self.manual_permanent_wilt_point = sheet_soil.cell(5, 8).value
-        # Arrays declaration
-        self.layer_thickness = np.zeros(self.total_layers)
-        self.cum_depth = np.zeros(self.total_layers)
-        self.clay = np.zeros(self.total_layers)
-        self.sand = np.zeros(self.total_layers)
-        self.organic_matter = np.zeros(self.total_layers)
-        self.bulk_density = np.zeros(self.total_layers)  # Mg/m3
-        self.field_capacity = np.zeros(self.total_layers)  # m3/m3
-        self.mean_field_capacity = 0
-        self.perm_wilt_point = np.zeros(self.total_layers)  # m3/m3
-        self.porosity = np.zeros(self.total_layers)  # m3/m3
-        self.b_value = np.zeros(self.total_layers)
-        self.kl = np.zeros(self.total_layers)  # cm2 / day
-        self.air_entry_potential = np.zeros(self.total_layers)
-        self.field_capacity_water_potential = np.zeros(self.total_layers)
-        self.plant_avail_water = np.zeros(self.total_layers)
-        self.init_plant_avail_water = np.zeros(self.total_layers)
-        self.water_content = np.zeros(self.total_layers)
-        self.init_water_avail = np.zeros(self.total_layers)
-        self.water_potential = np.zeros(self.total_layers)
-        self.perm_wilt_point_pot = np.zeros(self.total_layers)
-        self.sat_water_potential = np.zeros(self.total_layers)
-
-        for lyr in self.layers:
-            self.layer_thickness[lyr] = sheet_soil.cell(9 + lyr, 1).value
-            self.cum_depth[lyr] = sheet_soil.cell(9 + lyr, 2).value
-            self.clay[lyr] = sheet_soil.cell(9 + lyr, 3).value / 100
-            self.sand[lyr] = sheet_soil.cell(9 + lyr, 4).value / 100
-            if self.manual_organic_matter:
-                self.organic_matter[lyr] = sheet_soil.cell(9 + lyr, 5).value
-            else:
-                self.organic_matter[lyr] = organic_m(self.clay[lyr])
-            if self.manual_bulk_density:
-                self.bulk_density[lyr] = sheet_soil.cell(9 + lyr, 6).value
-            else:
-                self.bulk_density[lyr] = bulk_density(
-                    self.clay[lyr], self.sand[lyr], self.organic_matter[lyr]
-                )
-            self.porosity[lyr] = sat_water_content(self.bulk_density[lyr])
-            if self.manual_field_capacity:
-                self.field_capacity[lyr] = sheet_soil.cell(9 + lyr, 7).value
-            else:
-                self.field_capacity[lyr] = vol_water_content_33_j_kg(
-                    self.clay[lyr], self.sand[lyr], self.organic_matter[lyr]
-                )
-            if self.manual_permanent_wilt_point:
-                self.perm_wilt_point[lyr] = sheet_soil.cell(9 + lyr, 8).value
-            else:
-                self.perm_wilt_point[lyr] = vol_water_content_1500_jkg(
-                    self.clay[lyr], self.sand[lyr], self.organic_matter[lyr]
-                )
-            self.b_value[lyr] = b_value(
-                self.field_capacity[lyr], self.perm_wilt_point[lyr]
-            )
-            self.kl[lyr] = sheet_soil.cell(9 + lyr, 11).value
-            self.air_entry_potential[lyr] = air_entry_pot(
-                self.field_capacity[lyr], self.porosity[lyr], self.b_value[lyr]
-            )
-            if self.manual_field_capacity:
-                self.field_capacity_water_potential[lyr] = water_potential(
-                    self.porosity[lyr],
-                    self.air_entry_potential[lyr],
-                    self.b_value[lyr],
-                    self.field_capacity[lyr],
-                )
-            else:
-                self.field_capacity_water_potential[lyr] = (
-                    -0.35088 * self.clay[lyr] * 100 - 28.947
-                )  # needs ref
-                # calculated again using more accurate formula
-                self.field_capacity[lyr] = water_content(
-                    self.porosity[lyr],
-                    self.air_entry_potential[lyr],
-                    self.b_value[lyr],
-                    self.field_capacity_water_potential[lyr],
-                )
-            if not self.manual_permanent_wilt_point:
-                # calculated again using more accurate formula
-                self.perm_wilt_point[lyr] = water_content(
-                    self.porosity[lyr],
-                    self.air_entry_potential[lyr],
-                    self.b_value[lyr],
-                    PERMNT_WILT_POINT_WP,
-                )
-            assert (
-                self.perm_wilt_point[lyr] < self.field_capacity[lyr]
-            ), "Permanent wilting point must be less than field capacity"
-            self.plant_avail_water[lyr] = (
-                self.field_capacity[lyr] - self.perm_wilt_point[lyr]
-            )
-            self.init_plant_avail_water[lyr] = sheet_soil.cell(9 + lyr, 12).value
-            self.water_content[lyr] = (
-                self.init_plant_avail_water[lyr] * self.plant_avail_water[lyr]
-                + self.perm_wilt_point[lyr]
-            )
-            self.init_water_avail[lyr] = (
-                (self.water_content[lyr] - self.perm_wilt_point[lyr])
-                * self.layer_thickness[lyr]
-                * self.WATER_DENSITY
-            )
-            self.water_potential[lyr] = water_potential(
-                self.porosity[lyr],
-                self.air_entry_potential[lyr],
-                self.b_value[lyr],
-                self.water_content[lyr],
-            )
-            self.perm_wilt_point_pot[lyr] = water_potential(
-                self.porosity[lyr],
-                self.air_entry_potential[lyr],
-                self.b_value[lyr],
-                self.perm_wilt_point[lyr],
-            )
-            self.sat_water_potential[lyr] = water_potential(
-                self.porosity[lyr],
-                self.air_entry_potential[lyr],
-                self.b_value[lyr],
-                self.porosity[lyr],
-            )
+        self.daily_ref_evap_transp = daily_ref_evap_transp
+        self.manual_organic_matter = manual["organic_matter"]
+        self.manual_bulk_density = manual["bulk_density"]
+        self.manual_field_capacity = manual["field_capacity"]
+        self.manual_permanent_wilt_point = manual["perm_wilt_point"]
+        # layer_thickness, cum_depth (m), clay, sand (fraction), organic_matter,
+        # bulk_density (Mg/m3), field_capacity, perm_wilt_point, porosity
+        # (m3/m3), b_value, kl (cm2 / day), air_entry_potential,
+        # field_capacity_water_potential, plant_avail_water,
+        # init_plant_avail_water, water_content, init_water_avail,
+        # water_potential, perm_wilt_point_pot, sat_water_potential and
+        # mean_field_capacity
+        for name, value in props.items():
+            setattr(self, name, value)
+
+    def clone(self):
+        """Returns a copy of the soil that shares the soil properties and has
+        its own water content and water potential"""
+        soil = copy.copy(self)
+        for name in SoilSpec.MUTABLE:
+            setattr(soil, name, getattr(self, name).copy())
+        return soil
 
-        for lyr in self.layers:
-            self.mean_field_capacity += (
-                self.field_capacity[lyr] * self.layer_thickness[lyr]
+    def state(self):
+        """Returns a copy of the values that change during the simulation,
+        the SoilSpec.MUTABLE arrays and the reference evapotranspiration"""
+        state = {name: getattr(self, name).copy() for name in SoilSpec.MUTABLE}
+        state["daily_ref_evap_transp"] = self.daily_ref_evap_transp
+        return state
+
+    def restore(self, state):
+        """Sets the values of a soil state, see state"""
+        for name in SoilSpec.MUTABLE:
+            assert len(state[name]) == self.total_layers, (
+                "soil state of a %d layer profile, the soil has %d layers"
+                % (len(state[name]), self.total_layers)
             )
-        self.mean_field_capacity = self.mean_field_capacity / self.layer_thickness.sum()
+            getattr(self, name)[:] = state[name]
+        self.daily_ref_evap_transp = state["daily_ref_evap_transp"]
 
     def update_water_content(self, crop_list):
-        """updates soil water content based on each crop water uptake"""
+        """updates soil water content based on each crop water uptake
+
+        The whole profile is updated with array operations: each crop uptake
+        is subtracted from all layers at once and the water potential is
+        derived once from the resulting water content."""
+        layer_water = self.layer_thickness * self.WATER_DENSITY
         for crop in crop_list:
-            if True:  # crop.planted_flag:
-                for lyr in self.layers:
-                    self.water_content[lyr] = self.water_content[
-                        lyr
-                    ] - crop.water_uptake[lyr] / (
-                        self.layer_thickness[lyr] * self.WATER_DENSITY
-                    )
-                    self.water_potential[lyr] = water_potential(
-                        self.porosity[lyr],
-                        self.air_entry_potential[lyr],
-                        self.b_value[lyr],
-                        self.water_content[lyr],
-                    )
+            self.water_content -= crop.water_uptake / layer_water
+        self.water_potential[:] = water_potential(
+            self.porosity,
+            self.air_entry_potential,
+            self.b_value,
+            self.water_content,
+        )
+
+
+class SoilSpec(object):
+    """Soil properties parsed and derived once from the input workbook
+
+    The arrays of the spec are read-only. fresh_state returns a new soil in
+    its initial state, sharing them and copying only the water arrays.
+    """
+
+    # Arrays that change during the simulation
+    MUTABLE = ("water_content", "water_potential")
+
+    def __init__(self, book):
+        self.set_soil(Soil(book))
+
+    @classmethod
+    def from_soil(cls, soil):
+        """Returns the spec of a soil built without a workbook, e.g. by
+        build_soils or read from a soil store"""
+        spec = cls.__new__(cls)
+        spec.set_soil(soil)
+        return spec
+
+    def set_soil(self, soil):
+        self.soil = soil
+        self.total_layers = soil.total_layers
+        self.layers = soil.layers
+        self.freeze()
+
+    def __setstate__(self, state):
+        # Unpickled arrays are writeable again
+        self.__dict__.update(state)
+        self.freeze()
+
+    def freeze(self):
+        """Makes the soil arrays read-only"""
+        for value in vars(self.soil).values():
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+
+    def fresh_state(self):
+        """Returns a new soil in its initial state"""
+        return self.soil.clone()
@@ -0,0 +1,287 @@
+"""Benchmarks of the water uptake kernels, the soil and output classes and
+whole simulation runs, on synthetic soils of 10 to 1000 layers
+
+Times are saved in a JSON file that later runs compare against to catch
+performance regressions:
+
+    python benchmarks.py --save baseline.json
+    python benchmarks.py --compare baseline.json
+"""
+#!/usr/bin/env python
+from __future__ import division
+import argparse
+import datetime
+import json
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+
+import Model_water
+from Crop_class import UPTAKE_MODELS, Crop
+from inputs import TextBook
+from Print_class import PrintOutput, ResultsRecorder
+from Soil_class import Soil
+
+LAYER_COUNTS = [10, 30, 100, 300, 1000]
+SEASON_LENGTHS = [30, 120, 365]
+# Layer counts of the whole runs and spreadsheet outputs, xls sheets have at
+# most 256 columns (7 + 2 per layer on the soil sheet)
+RUN_LAYER_COUNTS = [10, 30, 100]
+# Crop parameters of the sim_data.xls crop
+CROP = {
+    "campbell_max_daily_transp": 10.0,
+    "dssat_max_water_uptake": 0.03,
+    "P2L": -500.0,
+    "P2H": -400.0,
+    "R2H": 5.0,
+    "R2L": 1.0,
+    "P0": -10.0,
+    "leaf_water_pot_stress_onset": -1100.0,
+    "leaf_water_pot_wilt_point": -2000.0,
+    "water_extraction_dist": 5.0,
+}
+# Slowdown over the baseline reported as a regression
+THRESHOLD = 1.5
+
+
+def synthetic_inputs(total_layers, season_length=100, seed=0):
+    """Returns the text input data of a 1 m synthetic soil profile
+
+    total_layers: number of soil layers
+    season_length: simulated days
+    seed: seed of the random soil texture
+    """
+    rng = np.random.default_rng(seed)
+    layer_thickness = np.full(total_layers, 1 / total_layers)
+    cum_depth = np.cumsum(layer_thickness)
+    root_dens = 20000 * np.exp(-3.5 * (cum_depth - layer_thickness))
+    start = datetime.date(2001, 1, 1)
+    end = start + datetime.timedelta(season_length)
+    return {
+        "inputs": {
+            "start_day": 1,
+            "end_day": end.timetuple().tm_yday,
+            "start_year": start.year,
+            "end_year": end.year,
+        },
+        "crops": [CROP],
+        "soil": {"root_depth": 1.0, "daily_ref_evap_transp": 5},
+        "layers": {
+            "layer_thickness": layer_thickness.tolist(),
+            "cum_depth": cum_depth.tolist(),
+            "clay": rng.uniform(5, 40, total_layers).tolist(),
+            "sand": rng.uniform(10, 50, total_layers).tolist(),
+            "root_dens": root_dens.tolist(),
+            "root_fraction": (root_dens / root_dens.sum()).tolist(),
+            "kl": np.linspace(0.085, 0.05, total_layers).tolist(),
+            "init_plant_avail_water": [1.0] * total_layers,
+        },
+    }
+
+
+def time_call(function, setup=None):
+    """Returns the best time of a call, s
+
+    setup: function called before each call, not timed, e.g. to reset the
+     state the call changes
+    """
+    timer = timeit.default_timer
+    times = []
+    total = 0
+    while len(times) < 5 or (total < 0.2 and len(times) < 1000):
+        if setup is not None:
+            setup()
+        start = timer()
+        function()
+        times.append(timer() - start)
+        total += times[-1]
+    return min(times)
+
+
+def kernel_benchmarks(total_layers):
+    """Times the daily water uptake of each model and the soil update"""
+    book = TextBook(synthetic_inputs(total_layers))
+    soil = Soil(book)
+    crop = Crop(1, 100, book, soil)
+    crop.light_intercpt = 1
+    water_content = soil.water_content.copy()
+    root_fraction = crop.root_fraction.copy()
+
+    def reset():
+        soil.water_content[:] = water_content
+        crop.root_fraction[:] = root_fraction
+
+    times = {}
+    for model, kernel in UPTAKE_MODELS.items():
+        reset()
+        kernel(crop, soil)  # per-soil constants and compilation
+        times["uptake_%s" % model] = time_call(
+            lambda kernel=kernel: kernel(crop, soil), reset
+        )
+    times["update_water_content"] = time_call(
+        lambda: soil.update_water_content([crop]), reset
+    )
+    times["soil_init"] = time_call(lambda: Soil(book))
+    return times
+
+
+def time_output(output_class, crop, soil, season_length, fname):
+    """Returns the time of one day of an output class and of saving a
+    season of it, s
+
+    output_class: function returning a new output
+    """
+    # Spreadsheet cells can only be written once, each call has a new output
+    outputs = []
+
+    def new_output():
+        outputs[:] = [output_class()]
+
+    def daily():
+        for sim_day in range(1, season_length + 1):
+            outputs[0].daily(sim_day, 2001, sim_day, crop, soil)
+
+    def filled_output():
+        new_output()
+        daily()
+
+    return (
+        time_call(daily, new_output) / season_length,
+        time_call(lambda: outputs[0].save_data(fname), filled_output),
+    )
+
+
+def output_benchmarks(total_layers, season_length):
+    """Times the daily outputs and saving them"""
+    book = TextBook(synthetic_inputs(total_layers, season_length))
+    soil = Soil(book)
+    crop = Crop(1, season_length, book, soil)
+    crop.light_intercpt = 1
+    UPTAKE_MODELS["dssat"](crop, soil)
+    folder = tempfile.mkdtemp()
+    times = {}
+    try:
+        for name, output_class in [
+            ("print_output", lambda: PrintOutput(soil)),
+            ("results_recorder", lambda: ResultsRecorder(soil, season_length)),
+        ]:
+            times["%s_daily" % name], times["%s_save_data" % name] = time_output(
+                output_class,
+                crop,
+                soil,
+                season_length,
+                os.path.join(folder, "output.xls"),
+            )
+    finally:
+        shutil.rmtree(folder)
+    return times
+
+
+def run_benchmark(total_layers, season_length, jit=True):
+    """Times a whole Model_water.main run of the six models
+
+    jit: compiled kernels when Numba is available
+    """
+    folder = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    argv = sys.argv
+    fname = os.path.join(folder, "synthetic.json")
+    with open(fname, "w") as json_file:
+        json.dump(synthetic_inputs(total_layers, season_length), json_file)
+    sys.argv = ["Model_water.py", fname, "--no-cache"] + ([] if jit else ["--no-jit"])
+    try:
+        os.chdir(folder)
+        return time_call(Model_water.main)
+    finally:
+        os.chdir(cwd)
+        sys.argv = argv
+        shutil.rmtree(folder)
+
+
+def run_benchmarks(layer_counts=LAYER_COUNTS, season_lengths=SEASON_LENGTHS, jit=True):
+    """Runs every benchmark and returns the times, s
+
+    jit: compiled kernels in the whole runs when Numba is available, the
+     kernels timed alone are those of UPTAKE_MODELS
+
+    Returns a dictionary of benchmark names, as name[layers] or
+    name[layers,days], and times
+    """
+    results = {}
+    for total_layers in layer_counts:
+        for name, seconds in kernel_benchmarks(total_layers).items():
+            results["%s[%d]" % (name, total_layers)] = seconds
+    for total_layers in layer_counts:
+        if total_layers not in RUN_LAYER_COUNTS:
+            continue
+        for season_length in season_lengths:
+            key = "[%d,%d]" % (total_layers, season_length)
+            for name, seconds in output_benchmarks(total_layers, season_length).items():
+                results[name + key] = seconds
+            results["main" + key] = run_benchmark(total_layers, season_length, jit)
+    return results
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """Returns the benchmarks slower than the baseline by more than the
+    threshold, as (name, time, baseline time)
+
+    >>> compare({"a": 2.0, "b": 1.0, "c": 1.0}, {"a": 1.0, "b": 1.0})
+    [('a', 2.0, 1.0)]
+    """
+    return [
+        (name, seconds, baseline[name])
+        for name, seconds in results.items()
+        if name in baseline and seconds > threshold * baseline[name]
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--save", help="save the times in a JSON file")
+    parser.add_argument("--compare", help="JSON file of baseline times")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument(
+        "--quick", action="store_true", help="10 and 100 layers, 30 day seasons"
+    )
+    parser.add_argument(
+        "--no-jit", action="store_true", help="time the reference kernels"
+    )
+    args = parser.parse_args()
+    from jit_backend import use_jit
+
+    use_jit(not args.no_jit)
+    if args.quick:
+        results = run_benchmarks([10, 100], [30], jit=not args.no_jit)
+    else:
+        results = run_benchmarks(jit=not args.no_jit)
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    for name, seconds in results.items():
+        if name in baseline:
+            print(
+                "%-40s %12.1f us %8.2fx"
+                % (name, seconds * 1e6, seconds / baseline[name])
+            )
+        else:
+            print("%-40s %12.1f us" % (name, seconds * 1e6))
+    if args.save:
+        with open(args.save, "w") as results_file:
+            json.dump(results, results_file, indent=2, sort_keys=True)
+    regressions = compare(results, baseline, args.threshold)
+    for name, seconds, baseline_seconds in regressions:
+        print(
+            "REGRESSION %s: %.1f us, baseline %.1f us"
+            % (name, seconds * 1e6, baseline_seconds * 1e6)
+        )
+    sys.exit(bool(regressions))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Closed-form fast-forward of APSIM water uptake runs
+
+With a constant reference evapotranspiration and light interception, the
+APSIM water uptake (Crop.water_uptake_apsim) followed by the soil water
+update has a piecewise closed-form trajectory. While the supply exceeds the
+demand the demand is shared in proportion to the supply, and with a uniform
+kl every layer keeps its share of the available water, which falls by the
+demand every day. Once the supply drops below the demand each layer loses a
+kl fraction of its available water a day.
+
+The state can so be moved to any later day in O(layers) instead of
+O(days x layers). The proportional phase has no closed form when kl differs
+between layers, it is then stepped day by day until the supply drops below
+the demand.
+
+    python fast_forward.py sim_data.xls --days 10,50,100
+"""
+#!/usr/bin/env python
+from __future__ import division
+import argparse
+import math
+
+import numpy as np
+
+from Crop_class import UPTAKE_MODELS
+from functions import water_potential
+
+
+def jump_apsim(crop, soil, days):
+    """Moves an APSIM crop and soil a number of days forward in closed form
+
+    Only the soil water and the cumulative transpiration are updated, the
+    crop daily values are left as they were (see advance_apsim).
+
+    crop: crop class with properties
+    soil: soil class with properties
+    days: days to move forward
+    """
+    transp_pot = soil.daily_ref_evap_transp * crop.light_intercpt
+    layer_water = soil.layer_thickness * soil.WATER_DENSITY
+    kl = soil.kl
+    avail_water = (soil.water_content - soil.perm_wilt_point) * layer_water
+    assert np.all(avail_water >= 0), "soil water below the wilting point"
+    assert np.all((kl >= 0) & (kl <= 1)), "kl must be between 0 and 1"
+    start_avail_water = avail_water.sum()
+    remaining = days
+    if transp_pot > 0:
+        uniform_kl = np.all(kl == kl[0])
+        # Demand shared in proportion to the supply
+        while remaining and transp_pot < (kl * avail_water).sum():
+            if uniform_kl:
+                tot_avail_water = avail_water.sum()
+                # Days until the supply no longer exceeds the demand
+                switch_day = math.ceil(
+                    (tot_avail_water - transp_pot / kl[0]) / transp_pot
+                )
+                steps = min(remaining, max(switch_day, 1))
+                avail_water = avail_water * (
+                    (tot_avail_water - steps * transp_pot) / tot_avail_water
+                )
+            else:
+                soil_wat_supply = kl * avail_water
+                steps = 1
+                avail_water = (
+                    avail_water - soil_wat_supply / soil_wat_supply.sum() * transp_pot
+                )
+            remaining -= steps
+        # Water is limiting, each layer loses its supply
+        if remaining:
+            avail_water = avail_water * (1 - kl) ** remaining
+    soil.water_content[:] = soil.perm_wilt_point + avail_water / layer_water
+    soil.water_potential[:] = water_potential(
+        soil.porosity, soil.air_entry_potential, soil.b_value, soil.water_content
+    )
+    crop.cum_transp += start_avail_water - avail_water.sum()
+    crop.cum_pot_transp += transp_pot * days
+
+
+def advance_apsim(crop, soil, days):
+    """Moves an APSIM crop and soil a number of days forward
+
+    All days but the last are jumped over in closed form, the last one is
+    simulated so that the crop daily water uptake and transpiration are
+    those of that day.
+    """
+    if days > 1:
+        jump_apsim(crop, soil, days - 1)
+    UPTAKE_MODELS["apsim"](crop, soil)
+    soil.update_water_content([crop])
+
+
+def apsim_output_days(crop, soil, output_days):
+    """Returns the APSIM results on some simulation days, jumping from one
+    to the next
+
+    crop: crop class with properties, in its state on day 0
+    soil: soil class with properties, in its state on day 0
+    output_days: increasing simulation days, the first day is 1
+
+    Returns a dictionary of arrays with one row per output day
+    """
+    results = {
+        "att_transp": np.zeros(len(output_days)),
+        "transp_ratio": np.zeros(len(output_days)),
+        "cum_transp": np.zeros(len(output_days)),
+        "cum_pot_transp": np.zeros(len(output_days)),
+        "water_content": np.zeros((len(output_days), soil.total_layers)),
+    }
+    sim_day = 0
+    for row, output_day in enumerate(output_days):
+        assert output_day > sim_day, "output days must be increasing"
+        advance_apsim(crop, soil, output_day - sim_day)
+        sim_day = output_day
+        results["att_transp"][row] = crop.att_transp
+        results["transp_ratio"][row] = crop.transp_ratio
+        results["cum_transp"][row] = crop.cum_transp
+        results["cum_pot_transp"][row] = crop.cum_pot_transp
+        results["water_content"][row] = soil.water_content
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="APSIM results on some days, without simulating every day"
+    )
+    parser.add_argument("input_file", nargs="?", default="sim_data.xls")
+    parser.add_argument(
+        "--days",
+        type=lambda text: [int(day) for day in text.split(",")],
+        required=True,
+        help="comma separated simulation days",
+    )
+    args = parser.parse_args()
+    from inputs import load_inputs
+
+    sim_inputs = load_inputs(args.input_file)
+    crop = sim_inputs.crop_spec.fresh_state()
+    crop.light_intercpt = 1  # All solar radiation intercepted by canopy
+    results = apsim_output_days(crop, sim_inputs.soil_spec.fresh_state(), args.days)
+    print("day  att_transp  transp_ratio  cum_transp  cum_pot_transp")
+    for row, day in enumerate(args.days):
+        print(
+            "%4d  %10.4f  %12.4f  %10.4f  %14.4f"
+            % (
+                day,
+                results["att_transp"][row],
+                results["transp_ratio"][row],
+                results["cum_transp"][row],
+                results["cum_pot_transp"][row],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -7,18 +7,25 @@ b_value
 air_entry_pot
 water_potential
 organic_m
+texture_class
+feddes_stress_threshold
 feddes_stress_factor
+feddes_stress_factor_profile
 p_wofost
+sat_vapor_pressure
+extraterrestrial_rad
+ref_evap_transp
 """
 # -*- coding: utf-8 -*-
 from __future__ import division
 import math
+import numpy as np
 
 
 def bulk_density(clay, sand, organic_matter):
     """(float, float,float) -> (float)
 
-    Returns Bulk density (Mg/m3 or g/cm3)
+    Returns Bulk density (Mg/m3 or g/cm3). Also accepts equally shaped arrays.
 
     clay: clay content (fraction)
     sand: sand content (fraction)
@@ -32,6 +39,9 @@ def bulk_density(clay, sand, organic_matter):
     1.43
     >>> bulk_density(0.15,0.2,2.29)
     1.39
+    >>> bulk_density(np.array([0.03, 0.15]), np.array([0.92, 0.2]),
+    ...              np.array([1.906, 2.29])).round(2)
+    array([1.43, 1.39])
     """
     MIN_SOIL_PARTICLE_DENS = 2.65
     x1 = (
@@ -68,7 +78,8 @@ def sat_water_content(bulk_density):
 def vol_water_content_33_j_kg(clay, sand, organic_matter):
     """(float,float,float) -> (float)
 
-    Returns the volumetric water content at field capacity (33 J/kg) (m3/m3)
+    Returns the volumetric water content at field capacity (33 J/kg) (m3/m3).
+    Also accepts equally shaped arrays.
 
     clay: clay content (fraction)
     sand: sand content (fraction)
@@ -98,7 +109,8 @@ def vol_water_content_33_j_kg(clay, sand, organic_matter):
 def vol_water_content_1500_jkg(clay, sand, organic_matter):
     """(float,float,float) -> (float)
 
-    Returns the volumetric water content at field capacity (33 J/kg) (m3/m3)
+    Returns the volumetric water content at field capacity (33 J/kg) (m3/m3).
+    Also accepts equally shaped arrays.
 
     clay: clay content (fraction)
     sand: sand content (fraction)
@@ -128,7 +140,7 @@ def vol_water_content_1500_jkg(clay, sand, organic_matter):
 def b_value(water_content_33_j_kg, water_content_1500_j_kg):
     """(float,float) -> float
 
-    Return b soil parameter
+    Return b soil parameter. Also accepts equally shaped arrays.
 
     water_content_33_j_kg: water content at -33 J/kg
     water_content_1500_j_kg: water content at -1500 J/kg
@@ -139,16 +151,18 @@ def b_value(water_content_33_j_kg, water_content_1500_j_kg):
 
     >>> b_value(0.08,0.03)
     3.89
+    >>> b_value(np.array([0.08, 0.38]), np.array([0.03, 0.21])).round(2)
+    array([3.89, 6.44])
     """
     return (math.log(1500) - math.log(33)) / (
-        math.log(water_content_33_j_kg) - math.log(water_content_1500_j_kg)
+        np.log(water_content_33_j_kg) - np.log(water_content_1500_j_kg)
     )
 
 
 def air_entry_pot(field_capacity, sat_water_content, b_value):
     """(float,float,float) -> float
 
-    Return air entry potential
+    Return air entry potential. Also accepts equally shaped arrays.
 
     field_capacity: water content at field capacity
     sat_water_content: saturated water content
@@ -165,7 +179,8 @@ def air_entry_pot(field_capacity, sat_water_content, b_value):
 def water_potential(sat_water_content, air_entry_potential, campbell_b, water_content):
     """(float,float,float,float) -> (float)
 
-    Returns Soil Water Potential (J/kg)
+    Returns Soil Water Potential (J/kg). Also accepts equally shaped arrays,
+    in which case the whole profile is computed and validated in one call.
 
     sat_water_content : saturation water content (m3/m3)
     air_entry_potential: air entry water potential (J/kg)
@@ -178,9 +193,12 @@ def water_potential(sat_water_content, air_entry_potential, campbell_b, water_co
     >>> water_potential (0.5, -1.5, 5, 0.25)
     -48.0
     >>> water_potential (0.20, -1.0, 4, 0.25)
-    -0.4096"""
-    assert sat_water_content > 0, "sat water content must be positive"
-    assert water_content > 0, "water content must be positive"
+    -0.4096
+    >>> water_potential(np.array([0.5, 0.2]), np.array([-1.5, -1.0]),
+    ...                 np.array([5, 4]), np.array([0.25, 0.25]))
+    array([-48.    ,  -0.4096])"""
+    assert np.all(sat_water_content > 0), "sat water content must be positive"
+    assert np.all(water_content > 0), "water content must be positive"
 
     return air_entry_potential * (sat_water_content / water_content) ** campbell_b
 
@@ -188,7 +206,7 @@ def water_potential(sat_water_content, air_entry_potential, campbell_b, water_co
 def water_content(sat_water_content, air_entry_potential, campbell_b, water_potential):
     """(float,float,float) -> (float)
 
-    Returns Soil water content (m3/m3)
+    Returns Soil water content (m3/m3). Also accepts equally shaped arrays.
 
     sat_water_content : saturation water content (m3/m3)
     air_entry_potential: air entry water potential (J/kg)
@@ -200,6 +218,9 @@ def water_content(sat_water_content, air_entry_potential, campbell_b, water_pote
 
     >>> water_content(0.5,-1.5,5,-52.7)
     0.24
+    >>> water_content(np.array([0.5, 0.2]), np.array([-1.5, -1.0]),
+    ...               np.array([5, 4]), np.array([-48.0, -0.4096]))
+    array([0.25, 0.25])
     """
     return sat_water_content * (water_potential / air_entry_potential) ** (
         -1 / campbell_b
@@ -224,6 +245,104 @@ def organic_m(clay):
     return 1.81 + 0.032 * clay * 100
 
 
+def texture_class(clay, sand):
+    """(float, float) -> str
+
+    Returns the USDA soil texture class. Also accepts equally shaped arrays,
+    in which case an array of class names is returned.
+
+    clay: clay content (%)
+    sand: sand content (%)
+
+    Reference: Soil Survey Staff, 1993. Soil survey manual. USDA Handbook 18.
+     U.S. Gov. Print. Office, Washington, DC.
+
+    >>> texture_class(20, 40)
+    'loam'
+    >>> texture_class(np.array([3, 50, 30]), np.array([92, 20, 10]))
+    array(['sand', 'clay', 'silty clay loam'], dtype='<U15')
+    """
+    silt = 100 - clay - sand
+    conditions = [
+        silt + 1.5 * clay < 15,
+        silt + 2 * clay < 30,
+        (clay >= 40) & (sand <= 45) & (silt < 40),
+        (clay >= 40) & (silt >= 40),
+        (clay >= 35) & (sand > 45),
+        (clay >= 27) & (sand <= 20),
+        (clay >= 27) & (sand <= 45),
+        (clay >= 20) & (silt < 28) & (sand > 45),
+        (clay >= 7) & (silt >= 28) & (silt < 50) & (sand <= 52),
+        (silt >= 80) & (clay < 12),
+        silt >= 50,
+    ]
+    choices = [
+        "sand",
+        "loamy sand",
+        "clay",
+        "silty clay",
+        "sandy clay",
+        "silty clay loam",
+        "clay loam",
+        "sandy clay loam",
+        "loam",
+        "silt",
+        "silt loam",
+    ]
+    texture = np.select(conditions, choices, default="sandy loam")
+    if np.ndim(texture):
+        return texture
+    return str(texture)
+
+
+def feddes_stress_threshold(
+    transp_pot,
+    water_pot_stress_low_t,
+    water_pot_stress_high_t,
+    transp_high,
+    transp_low,
+):
+    """
+    Demand dependent water potential below which root water uptake is
+    reduced (J/kg)
+
+    transp_pot: potential transpiration, mm/day
+    water_pot_stress_low_t: stress threshold for low T demand, J/kg
+    water_pot_stress_high_t: stress threshold for high T demand, J/kg
+
+    Reference: Feddes, R. A., P. J. Kowalik, and H. Zaradny. 1978. Simulation
+     of field water use and crop yield. Wageningen.
+
+    >>> feddes_stress_threshold(3, -500, -400, 5, 1)
+    -450.0
+    >>> feddes_stress_threshold(np.array([0.5, 3, 6]), -500, -400, 5, 1)
+    array([-500., -450., -400.])
+    """
+    if np.ndim(transp_pot):
+        # One threshold for each potential transpiration value
+        return np.where(
+            transp_pot < transp_low,
+            water_pot_stress_low_t,
+            np.where(
+                transp_pot > transp_high,
+                water_pot_stress_high_t,
+                water_pot_stress_high_t
+                + (transp_high - transp_pot)
+                / (transp_high - transp_low)
+                * (water_pot_stress_low_t - water_pot_stress_high_t),
+            ),
+        )
+    if transp_pot < transp_low:
+        water_pot_stress = water_pot_stress_low_t
+    if transp_pot > transp_high:
+        water_pot_stress = water_pot_stress_high_t
+    if transp_pot >= transp_low and transp_pot <= transp_high:
+        water_pot_stress = water_pot_stress_high_t + (transp_high - transp_pot) / (
+            transp_high - transp_low
+        ) * (water_pot_stress_low_t - water_pot_stress_high_t)
+    return water_pot_stress
+
+
 def feddes_stress_factor(
     transp_pot,
     water_pot,
@@ -251,14 +370,13 @@ def feddes_stress_factor(
      Saturated Media. FAlfa function
     """
     assert water_pot < 0, "water potential cannot be positive"
-    if transp_pot < transp_low:
-        water_pot_stress = water_pot_stress_low_t
-    if transp_pot > transp_high:
-        water_pot_stress = water_pot_stress_high_t
-    if transp_pot >= transp_low and transp_pot <= transp_high:
-        water_pot_stress = water_pot_stress_high_t + (transp_high - transp_pot) / (
-            transp_high - transp_low
-        ) * (water_pot_stress_low_t - water_pot_stress_high_t)
+    water_pot_stress = feddes_stress_threshold(
+        transp_pot,
+        water_pot_stress_low_t,
+        water_pot_stress_high_t,
+        transp_high,
+        transp_low,
+    )
     # Stressed condition, reducing transpiration
     if water_pot > water_pot_wilting and water_pot < water_pot_stress:
         return (water_pot - water_pot_wilting) / (water_pot_stress - water_pot_wilting)
@@ -276,6 +394,55 @@ def feddes_stress_factor(
         return 0
 
 
+def feddes_stress_factor_profile(
+    transp_pot,
+    water_pot,
+    water_pot_sat,
+    water_pot_field_cap,
+    water_pot_stress_low_t,
+    water_pot_stress_high_t,
+    water_pot_wilting,
+    transp_high,
+    transp_low,
+):
+    """
+    Reduction coefficients for root water uptake of a whole soil profile
+
+    Same as feddes_stress_factor, but water_pot is an array with the water
+    potential of every layer (J/kg). The demand dependent stress threshold is
+    computed once for all layers. Parameters may also be arrays that
+    broadcast against water_pot, e.g. one value per scenario.
+
+    >>> feddes_stress_factor_profile(
+    ...     3, np.array([-5.0, -20, -300, -600, -9000]), -10, -25, -500, -400,
+    ...     -8000, 5, 1)
+    array([0.        , 0.66666667, 1.        , 0.98013245, 0.        ])
+    """
+    assert np.all(water_pot < 0), "water potential cannot be positive"
+    water_pot_stress = feddes_stress_threshold(
+        transp_pot,
+        water_pot_stress_low_t,
+        water_pot_stress_high_t,
+        transp_high,
+        transp_low,
+    )
+    conditions = [
+        # Stressed condition, reducing transpiration
+        (water_pot > water_pot_wilting) & (water_pot < water_pot_stress),
+        # Optimal conditions
+        (water_pot >= water_pot_stress) & (water_pot <= water_pot_field_cap),
+        # Saturated conditions (reducing T)
+        (water_pot > water_pot_field_cap) & (water_pot < water_pot_sat),
+    ]
+    choices = [
+        (water_pot - water_pot_wilting) / (water_pot_stress - water_pot_wilting),
+        1.0,
+        (water_pot - water_pot_sat) / (water_pot_field_cap - water_pot_sat),
+    ]
+    # Beyond wilting or saturation water potential
+    return np.select(conditions, choices, default=0.0)
+
+
 def p_wofost(ET, drought_cat):
     """(float, int) -> float
     Calculates the soil water depletion factor (p) as a function of potential
@@ -296,6 +463,8 @@ def p_wofost(ET, drought_cat):
     0.5622516556291391
     >>> p_wofost(10, 4)
     0.34247787610619473
+    >>> p_wofost(np.array([5, 10, 40]), 4)
+    array([0.56225166, 0.34247788, 0.1       ])
     """
     MM_TO_CM = 10.0
     ET = ET / MM_TO_CM
@@ -304,6 +473,8 @@ def p_wofost(ET, drought_cat):
     stress_fact = 1.0 / (A + B * ET) - (5.0 - drought_cat) * 0.10
     if drought_cat < 3:
         stress_fact = stress_fact + (ET - 0.6) / (drought_cat * (drought_cat + 3.0))
+    if np.ndim(stress_fact):
+        return np.clip(stress_fact, 0.1, 0.95)
     if stress_fact < 0.1:
         stress_fact = 0.1
     if stress_fact > 0.95:
@@ -345,3 +516,100 @@ def vapor_press_defct_ave(max_sat_vap_press, min_sat_vap_press, air_vap_press):
 def vapor_press_defct_max(max_sat_vap_press, min_relative_humidity):
     """max vapor presure deficit"""
     return 0.67 * max_sat_vap_press * (1 - min_relative_humidity / 100.0)
+
+
+def sat_vapor_pressure(temp):
+    """Returns the saturation vapor pressure (kPa) of air at a temperature
+    (C). Also accepts arrays.
+
+    Reference: Allen, R.G., Pereira, L.S., Raes, D., Smith, M., 1998. Crop
+     evapotranspiration. FAO Irrigation and drainage paper 56. Eq. 11
+
+    >>> round(float(sat_vapor_pressure(21.5)), 3)
+    2.564
+    """
+    return 0.6108 * np.exp(17.27 * temp / (temp + 237.3))
+
+
+def extraterrestrial_rad(latitude, doy):
+    """Returns the daily extraterrestrial radiation (MJ/m2/d). Also accepts
+    arrays of days.
+
+    latitude: latitude (degrees, negative south)
+    doy: day of year
+
+    Reference: Allen et al., 1998. FAO Irrigation and drainage paper 56.
+     Eq. 21-25
+
+    >>> round(float(extraterrestrial_rad(50.8, 187)), 2)
+    41.09
+    """
+    SOLAR_CONSTANT = 0.0820  # MJ/m2/min
+    MINUTES_PER_DAY = 24 * 60
+    latitude = np.radians(latitude)
+    inv_rel_dist = 1 + 0.033 * np.cos(2 * np.pi / 365 * doy)
+    declination = 0.409 * np.sin(2 * np.pi / 365 * doy - 1.39)
+    sunset_angle = np.arccos(np.clip(-np.tan(latitude) * np.tan(declination), -1, 1))
+    return (
+        MINUTES_PER_DAY
+        / np.pi
+        * SOLAR_CONSTANT
+        * inv_rel_dist
+        * (
+            sunset_angle * np.sin(latitude) * np.sin(declination)
+            + np.cos(latitude) * np.cos(declination) * np.sin(sunset_angle)
+        )
+    )
+
+
+def ref_evap_transp(
+    temp_max, temp_min, rh_max, rh_min, solar_rad, wind_speed, doy, latitude, elevation
+):
+    """Returns the FAO-56 Penman-Monteith daily reference evapotranspiration
+    (mm/d), not below 0. The weather arguments also accept equally shaped
+    arrays, e.g. a whole weather record.
+
+    temp_max, temp_min: max and min air temperature (C)
+    rh_max, rh_min: max and min relative humidity (0 - 100)
+    solar_rad: solar radiation (MJ/m2/d)
+    wind_speed: wind speed at 2 m (m/s)
+    doy: day of year
+    latitude: latitude (degrees, negative south)
+    elevation: elevation above sea level (m)
+
+    Reference: Allen et al., 1998. FAO Irrigation and drainage paper 56.
+     Eq. 6, Example 18
+
+    >>> round(float(ref_evap_transp(21.5, 12.3, 84, 63, 22.07, 2.078, 187,
+    ...                             50.8, 100)), 1)
+    3.9
+    """
+    STEFAN_BOLTZMANN = 4.903e-9  # MJ/K4/m2/d
+    temp_mean = (temp_max + temp_min) / 2
+    sat_vap_press_max = sat_vapor_pressure(temp_max)
+    sat_vap_press_min = sat_vapor_pressure(temp_min)
+    air_vap_press = vapor_pressure_air(
+        sat_vap_press_min, sat_vap_press_max, rh_max, rh_min
+    )
+    vap_press_deficit = vapor_press_defct_ave(
+        sat_vap_press_max, sat_vap_press_min, air_vap_press
+    )
+    # Slope of the saturation vapor pressure curve, kPa/C
+    slope = 4098 * sat_vapor_pressure(temp_mean) / (temp_mean + 237.3) ** 2
+    atm_pressure = 101.3 * ((293 - 0.0065 * elevation) / 293) ** 5.26  # kPa
+    psychr_const = 0.000665 * atm_pressure  # kPa/C
+    clear_sky_rad = (0.75 + 2e-5 * elevation) * extraterrestrial_rad(latitude, doy)
+    net_shortwave_rad = 0.77 * solar_rad  # albedo 0.23
+    net_longwave_rad = (
+        STEFAN_BOLTZMANN
+        * ((temp_max + 273.16) ** 4 + (temp_min + 273.16) ** 4)
+        / 2
+        * (0.34 - 0.14 * np.sqrt(air_vap_press))
+        * (1.35 * np.minimum(solar_rad / clear_sky_rad, 1) - 0.35)
+    )
+    net_rad = net_shortwave_rad - net_longwave_rad  # soil heat flux of 0
+    ref_et = (
+        0.408 * slope * net_rad
+        + psychr_const * 900 / (temp_mean + 273) * wind_speed * vap_press_deficit
+    ) / (slope + psychr_const * (1 + 0.34 * wind_speed))
+    return np.maximum(ref_et, 0)
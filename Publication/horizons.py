@@ -0,0 +1,136 @@
+"""Discretizes soil horizons into layers
+
+A horizon description has a few rows with the LAYER_COLUMNS of the input
+files, cum_depth being the bottom of each horizon. Each layer gets the
+thickness weighted mean of the horizons it overlaps, the root fraction of a
+horizon is split between its layers by thickness. Text input files use
+horizons instead of layers with:
+
+    "horizons": {"cum_depth": [0.3, 1.0, 2.0], "clay": [...], ...},
+    "discretization": {"layer_thickness": 0.01}
+
+    python horizons.py horizons.csv layers.csv --layer-thickness 0.01
+"""
+#!/usr/bin/env python
+from __future__ import division
+import argparse
+import csv
+
+import numpy as np
+
+# Horizon columns split by thickness, the others are averaged
+SPLIT_COLUMNS = ["root_fraction"]
+
+
+def layer_depths(total_depth, total_layers=None, layer_thickness=None):
+    """Returns the thickness and cumulative depth of equal layers, m
+
+    total_depth: depth of the profile, m
+    total_layers: number of layers
+    layer_thickness: thickness of the layers instead of their number, it
+     must divide the profile depth
+
+    >>> layer_depths(1.0, 4)[1]
+    array([0.25, 0.5 , 0.75, 1.  ])
+    """
+    assert (total_layers is None) != (layer_thickness is None), (
+        "give either the number or the thickness of the layers"
+    )
+    if total_layers is None:
+        total_layers = int(round(total_depth / layer_thickness))
+        assert np.isclose(total_layers * layer_thickness, total_depth), (
+            "layer thickness %g does not divide the %g m profile"
+            % (layer_thickness, total_depth)
+        )
+    cum_depth = total_depth * np.arange(1, total_layers + 1) / total_layers
+    return np.diff(cum_depth, prepend=0), cum_depth
+
+
+def discretize(horizons, total_layers=None, layer_thickness=None):
+    """Returns the layer columns of equal layers over a horizon description
+
+    horizons: dictionary of horizon columns, cum_depth is the bottom of each
+     horizon, m, and the others are in the LAYER_COLUMNS units. Columns with
+     missing values ("") are left out.
+    total_layers, layer_thickness: see layer_depths
+
+    Returns a dictionary of arrays with one value per layer
+
+    >>> layers = discretize({"cum_depth": [0.2, 0.5], "clay": [10, 40],
+    ...     "root_fraction": [0.6, 0.4]}, 4)
+    >>> layers["clay"]
+    array([10., 22., 40., 40.])
+    >>> layers["root_fraction"].round(3)
+    array([0.375, 0.292, 0.167, 0.167])
+    """
+    bottom = np.asarray(horizons["cum_depth"], dtype=float)
+    thickness, cum_depth = layer_depths(bottom[-1], total_layers, layer_thickness)
+    return regrid(horizons, thickness, cum_depth)
+
+
+def regrid(horizons, layer_thickness, cum_depth):
+    """Returns the layer columns of a horizon description over given layers,
+    e.g. to move the roots of one soil profile to the layers of another
+
+    horizons: see discretize
+    layer_thickness, cum_depth: layers, m, layers below the horizons get 0
+
+    >>> regrid({"cum_depth": [0.1, 0.2], "root_dens": [300.0, 100.0]},
+    ...        np.array([0.05, 0.15, 0.1]), np.array([0.05, 0.2, 0.3])
+    ...        )["root_dens"].round(2)
+    array([300.  , 166.67,   0.  ])
+    """
+    bottom = np.asarray(horizons["cum_depth"], dtype=float)
+    top = np.append(0, bottom[:-1])
+    assert np.all(bottom > top), "horizon depths must be increasing"
+    thickness = np.asarray(layer_thickness, dtype=float)
+    cum_depth = np.asarray(cum_depth, dtype=float)
+    # Depth of each (layer, horizon) overlap, horizons are few so the cost is
+    # linear in the layers
+    overlap = np.clip(
+        np.minimum(cum_depth[:, None], bottom)
+        - np.maximum((cum_depth - thickness)[:, None], top),
+        0,
+        None,
+    )
+    layers = {"layer_thickness": thickness, "cum_depth": cum_depth}
+    for name, values in horizons.items():
+        if name in layers or "" in list(values):
+            continue
+        values = np.asarray(values, dtype=float)
+        if name in SPLIT_COLUMNS:
+            layers[name] = overlap.dot(values / (bottom - top))
+        else:
+            layers[name] = overlap.dot(values) / thickness
+    if "root_dens" in layers and "root_fraction" not in horizons:
+        # Root length fraction of each layer
+        root_length = layers["root_dens"] * thickness
+        layers["root_fraction"] = root_length / root_length.sum()
+    return layers
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Writes the layers of a horizon description to a csv file"
+    )
+    parser.add_argument("horizons", help="csv file with one row per horizon")
+    parser.add_argument("layers", help="output csv file with one row per layer")
+    layers_size = parser.add_mutually_exclusive_group(required=True)
+    layers_size.add_argument("--layers", type=int, help="number of layers")
+    layers_size.add_argument("--layer-thickness", type=float, help="m")
+    args = parser.parse_args()
+    from inputs import read_layers_csv
+
+    layers = discretize(
+        read_layers_csv(args.horizons), args.layers, args.layer_thickness
+    )
+    with open(args.layers, "w", newline="") as layers_file:
+        writer = csv.writer(layers_file)
+        writer.writerow(list(layers))
+        writer.writerows(
+            zip(*[["%.17g" % value for value in values] for values in layers.values()])
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""Reads the simulation inputs from the sim_data.xls workbook or from an
+equivalent JSON or TOML text file, and keeps the parsed inputs in a binary
+cache keyed by the file hash so that repeated runs skip parsing"""
+#!/usr/bin/env python
+from __future__ import division
+import argparse
+import csv
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+from Crop_class import CropSpec
+from horizons import discretize
+from Soil_class import LAYER_COLUMNS as SOIL_LAYER_COLUMNS
+from Soil_class import ROOT_COLUMNS, SoilSpec
+
+# inputs sheet cells of the simulation control
+CONTROL_CELLS = {
+    "start_day": (2, 1),
+    "end_day": (3, 1),
+    "start_year": (4, 1),
+    "end_year": (5, 1),
+}
+# inputs sheet rows of the crop parameters, the column is the crop number
+CROP_ROWS = {
+    "campbell_max_daily_transp": 6,
+    "dssat_max_water_uptake": 7,
+    "P2L": 8,
+    "P2H": 9,
+    "R2H": 10,
+    "R2L": 11,
+    "P0": 12,
+    "leaf_water_pot_stress_onset": 13,
+    "leaf_water_pot_wilt_point": 14,
+    "water_extraction_dist": 15,
+}
+# soil sheet cells of the soil profile settings
+SOIL_CELLS = {
+    "root_depth": (3, 4),
+    "total_layers": (4, 2),
+    "daily_ref_evap_transp": (5, 2),
+    "manual_organic_matter": (5, 5),
+    "manual_bulk_density": (5, 6),
+    "manual_field_capacity": (5, 7),
+    "manual_permanent_wilt_point": (5, 8),
+}
+# soil sheet columns of the layer properties, one row per layer
+FIRST_LAYER_ROW = 9
+# Soil and crop root columns, in sheet order
+LAYER_COLUMNS = dict(
+    sorted(
+        dict(SOIL_LAYER_COLUMNS, **ROOT_COLUMNS).items(), key=lambda item: item[1]
+    )
+)
+# Modules whose code changes the parsed inputs
+PARSER_MODULES = [
+    "inputs.py",
+    "Soil_class.py",
+    "Crop_class.py",
+    "functions.py",
+    "horizons.py",
+]
+CACHE_DIR = ".input_cache"
+
+
+class Cell(object):
+    """Workbook cell value"""
+
+    def __init__(self, value):
+        self.value = value
+
+
+class TextSheet(object):
+    """Worksheet with the cell values of a text input file"""
+
+    def __init__(self, name):
+        self.name = name
+        self.values = {}
+
+    def cell(self, row, col):
+        # Missing cells are empty, as in xlrd
+        return Cell(self.values.get((row, col), ""))
+
+
+class TextBook(object):
+    """Input workbook with the values of a text input file
+
+    data: dictionary with the inputs, crops, soil and layers sections
+    """
+
+    def __init__(self, data):
+        self.sheets = {"inputs": TextSheet("inputs"), "soil": TextSheet("soil")}
+        sheet_inputs = self.sheets["inputs"]
+        sheet_soil = self.sheets["soil"]
+        for name, value in data["inputs"].items():
+            sheet_inputs.values[CONTROL_CELLS[name]] = value
+        for crop_no, crop in enumerate(data["crops"], 1):
+            for name, value in crop.items():
+                sheet_inputs.values[(CROP_ROWS[name], crop_no)] = value
+        layers = data["layers"]
+        total_layers = len(layers["layer_thickness"])
+        sheet_soil.values[SOIL_CELLS["total_layers"]] = total_layers
+        for name, value in data["soil"].items():
+            sheet_soil.values[SOIL_CELLS[name]] = value
+        for name, values in layers.items():
+            assert len(values) == total_layers, "%s needs one value per layer" % name
+            for lyr, value in enumerate(values):
+                sheet_soil.values[(FIRST_LAYER_ROW + lyr, LAYER_COLUMNS[name])] = value
+
+    def sheet_by_name(self, name):
+        return self.sheets[name]
+
+    def sheet_names(self):
+        return list(self.sheets)
+
+
+class SimInputs(object):
+    """Parsed simulation inputs: control dates and soil and crop specs"""
+
+    def __init__(self, start_day, end_day, start_year, end_year, book):
+        self.start_day = start_day
+        self.end_day = end_day
+        self.start_year = start_year
+        self.end_year = end_year
+        self.sim_length = 366 - start_day + (end_year - start_year) * 366
+        self.soil_spec = SoilSpec(book)
+        self.crop_spec = CropSpec(1, self.sim_length, book, self.soil_spec)
+
+
+def parse_book(book):
+    """Returns the simulation inputs of a workbook (sim_data.xls layout)"""
+    sheet_inputs = book.sheet_by_name("inputs")
+    control = {
+        name: int(sheet_inputs.cell(row, col).value)
+        for name, (row, col) in CONTROL_CELLS.items()
+    }
+    return SimInputs(book=book, **control)
+
+
+def book_to_dict(book):
+    """Returns the values of a workbook in the text input layout"""
+    sheet_inputs = book.sheet_by_name("inputs")
+    sheet_soil = book.sheet_by_name("soil")
+    total_layers = int(sheet_soil.cell(*SOIL_CELLS["total_layers"]).value)
+    crops = []
+    for crop_no in range(1, sheet_inputs.ncols):
+        crops.append(
+            {
+                name: sheet_inputs.cell(row, crop_no).value
+                for name, row in CROP_ROWS.items()
+            }
+        )
+    return {
+        "inputs": {
+            name: sheet_inputs.cell(row, col).value
+            for name, (row, col) in CONTROL_CELLS.items()
+        },
+        "crops": crops,
+        "soil": {
+            name: sheet_soil.cell(row, col).value
+            for name, (row, col) in SOIL_CELLS.items()
+            if name != "total_layers"
+        },
+        "layers": {
+            name: [
+                sheet_soil.cell(FIRST_LAYER_ROW + lyr, col).value
+                for lyr in range(total_layers)
+            ]
+            for name, col in LAYER_COLUMNS.items()
+        },
+    }
+
+
+def read_layers_csv(fname):
+    """Returns the layer columns of a csv file with LAYER_COLUMNS headers"""
+    with open(fname, newline="") as layers_file:
+        rows = list(csv.DictReader(layers_file))
+    return {
+        name: [float(row[name]) if row[name] else "" for row in rows]
+        for name in rows[0]
+    }
+
+
+def read_text(fname):
+    """Returns the values of a JSON or TOML input file
+
+    The layers section may be the name of a csv file, relative to the input
+    file, with one column per layer property. A horizons section, also a
+    dictionary or a csv file, replaces the layers with those of the
+    discretization section (see horizons.discretize).
+    """
+    if fname.endswith(".toml"):
+        import tomllib
+
+        with open(fname, "rb") as toml_file:
+            data = tomllib.load(toml_file)
+    else:
+        with open(fname) as json_file:
+            data = json.load(json_file)
+    for section in ["layers", "horizons"]:
+        if isinstance(data.get(section), str):
+            data[section] = read_layers_csv(
+                os.path.join(os.path.dirname(fname), data[section])
+            )
+    if "horizons" in data:
+        data["layers"] = discretize(data["horizons"], **data["discretization"])
+    return data
+
+
+def input_files(fname):
+    """Returns the files an input file reads"""
+    files = [fname]
+    if not fname.endswith(".xls"):
+        with open(fname, "rb") as text_file:
+            text = text_file.read().decode("utf-8")
+        if fname.endswith(".toml"):
+            import tomllib
+
+            data = tomllib.loads(text)
+        else:
+            data = json.loads(text)
+        for section in ["layers", "horizons"]:
+            if isinstance(data.get(section), str):
+                files.append(os.path.join(os.path.dirname(fname), data[section]))
+    return files
+
+
+def cache_key(fname):
+    """Returns the hash of an input file, the files it reads and the parser
+    code"""
+    key = hashlib.sha256()
+    folder = os.path.dirname(os.path.abspath(__file__))
+    for path in input_files(fname) + [
+        os.path.join(folder, module) for module in PARSER_MODULES
+    ]:
+        with open(path, "rb") as data:
+            key.update(data.read())
+    return key.hexdigest()
+
+
+def load_inputs(fname, cache_dir=CACHE_DIR):
+    """Returns the simulation inputs of a .xls, .json or .toml file
+
+    fname: input file
+    cache_dir: folder of the parsed inputs cache, no cache if None
+    """
+    if cache_dir is not None:
+        cache_file = os.path.join(cache_dir, cache_key(fname) + ".pickle")
+        if os.path.exists(cache_file):
+            try:
+                with open(cache_file, "rb") as cached:
+                    return pickle.load(cached)
+            except (EOFError, pickle.UnpicklingError):
+                # Truncated file, parsed again and replaced
+                pass
+    if fname.endswith(".xls"):
+        from xlrd import open_workbook
+
+        book = open_workbook(fname)
+    else:
+        book = TextBook(read_text(fname))
+    sim_inputs = parse_book(book)
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Written under a temporary name, other processes never read a
+        # partial file
+        with tempfile.NamedTemporaryFile(dir=cache_dir, delete=False) as cached:
+            pickle.dump(sim_inputs, cached, pickle.HIGHEST_PROTOCOL)
+        os.replace(cached.name, cache_file)
+    return sim_inputs
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Converts an input workbook to a JSON input file"
+    )
+    parser.add_argument("workbook")
+    parser.add_argument("json_file")
+    args = parser.parse_args()
+    from xlrd import open_workbook
+
+    with open(args.json_file, "w") as json_file:
+        json.dump(book_to_dict(open_workbook(args.workbook)), json_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
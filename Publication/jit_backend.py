@@ -0,0 +1,508 @@
+"""Optional compiled backend of the water uptake models
+
+The kernels below are the layer loops of the Crop water uptake methods
+written on plain arrays, so that Numba can compile them in nopython mode.
+When Numba is installed, use_jit() registers them in place of the reference
+methods; without Numba the reference methods are kept. Numba is only
+imported, and the kernels compiled, on the first day a compiled kernel
+runs, so that runs that never simulate do not pay for it.
+
+compare_backends runs the reference and the compiled kernels side by side
+and reports their largest deviations:
+
+    python jit_backend.py sim_data.xls
+"""
+#!/usr/bin/env python
+from __future__ import division
+import argparse
+import importlib.util
+import math
+import sys
+
+import numpy as np
+
+from Crop_class import UPTAKE_MODELS, register_model
+from functions import feddes_stress_threshold, p_wofost
+
+JIT_AVAILABLE = importlib.util.find_spec("numba") is not None
+
+
+# Reference kernel of each model, replaced by use_jit
+REFERENCE_MODELS = dict(UPTAKE_MODELS)
+# Largest relative deviation accepted by compare_backends
+TOLERANCE = 1e-12
+
+
+def campbell_kernel(
+    water_potential,
+    root_cond_adj,
+    plant_hydr_cond,
+    tot_plant_hydr_cond,
+    expect_transp,
+    stress_onset,
+    wilt_point,
+    water_uptake,
+):
+    """Campbell leaf water potential solve and water uptake, with the plant
+    conductances of Crop.bind_campbell. Returns the attainable transpiration"""
+    total_layers = water_potential.shape[0]
+    soil_water_pot_avg = 0.0
+    for lyr in range(total_layers):
+        soil_water_pot_avg += water_potential[lyr] * root_cond_adj[lyr]
+    leaf_water_pot = soil_water_pot_avg - expect_transp / tot_plant_hydr_cond
+    if leaf_water_pot < stress_onset:
+        leaf_water_pot = (
+            tot_plant_hydr_cond * soil_water_pot_avg * (stress_onset - wilt_point)
+            + wilt_point * expect_transp
+        ) / (tot_plant_hydr_cond * (stress_onset - wilt_point) + expect_transp)
+    if leaf_water_pot < wilt_point:
+        leaf_water_pot = wilt_point
+        att_transp = 0.0
+        transp_ratio = att_transp / expect_transp
+    elif leaf_water_pot < stress_onset:
+        att_transp = (
+            expect_transp * (leaf_water_pot - wilt_point) / (stress_onset - wilt_point)
+        )
+        transp_ratio = att_transp / expect_transp
+    else:
+        att_transp = expect_transp
+        transp_ratio = 1.0
+    for lyr in range(total_layers):
+        uptake = (
+            plant_hydr_cond[lyr]
+            * (water_potential[lyr] - leaf_water_pot)
+            * transp_ratio
+        )
+        water_uptake[lyr] = uptake if uptake > 0 else 0.0
+    return att_transp
+
+
+def dssat_kernel(
+    water_content,
+    perm_wilt_point,
+    layer_thickness,
+    root_dens,
+    max_water_uptake,
+    transp_pot,
+    water_uptake,
+):
+    """DSSAT water uptake, root_dens in m/m3 and layer_thickness in m"""
+    CONV1 = 1e-4  # convert m/m3 to cm/cm3
+    CONV2 = 100.0  # convert m to cm
+    CONV3 = 10.0  # convert cm to mm
+    CONST1 = 1.3e-3
+    CONST3 = 7.01
+    total_layers = water_content.shape[0]
+    crop_transp = 0.0
+    for lyr in range(total_layers):
+        layer_root_dens = root_dens[lyr] * CONV1
+        avail_water = water_content[lyr] - perm_wilt_point[lyr]
+        uptake = 0.0
+        if layer_root_dens > 0.00001 and avail_water > 0:
+            if perm_wilt_point[lyr] > 0.3:
+                const2 = 45.0
+            else:
+                const2 = 120 - 250 * perm_wilt_point[lyr]
+            uptake = min(
+                CONST1
+                * math.exp(min(const2 * avail_water, 40.0))
+                / (CONST3 - math.log(layer_root_dens)),
+                max_water_uptake,
+            )
+        water_uptake[lyr] = (
+            uptake * (layer_thickness[lyr] * CONV2) * layer_root_dens * CONV3
+        )
+        crop_transp += water_uptake[lyr]
+    min_transp = min(transp_pot, crop_transp)
+    for lyr in range(total_layers):
+        if min_transp > 0:
+            water_uptake[lyr] = water_uptake[lyr] * (min_transp / crop_transp)
+        else:
+            water_uptake[lyr] = 0.0
+
+
+def apsim_kernel(
+    water_content, perm_wilt_point, layer_thickness, kl, transp_pot, water_uptake
+):
+    """APSIM water uptake, supply proportional to the available water"""
+    WATER_DENSITY = 1000.0
+    total_layers = water_content.shape[0]
+    tot_supply = 0.0
+    for lyr in range(total_layers):
+        water_uptake[lyr] = (
+            (water_content[lyr] - perm_wilt_point[lyr])
+            * layer_thickness[lyr]
+            * WATER_DENSITY
+            * kl[lyr]
+        )
+        tot_supply += water_uptake[lyr]
+    if tot_supply <= 0 or transp_pot <= 0:
+        water_uptake[:] = 0.0
+    elif transp_pot < tot_supply:
+        # distribute demand proportionately to the water supply
+        for lyr in range(total_layers):
+            water_uptake[lyr] = water_uptake[lyr] / tot_supply * transp_pot
+
+
+def feddes_kernel(
+    water_potential, root_fraction, transp_pot, P0, P1, P2, P3, water_uptake
+):
+    """Feddes water uptake, P2 is the demand dependent stress threshold"""
+    total_layers = water_potential.shape[0]
+    for lyr in range(total_layers):
+        pot = water_potential[lyr]
+        if P3 < pot < P2:
+            stress_fact = (pot - P3) / (P2 - P3)
+        elif P2 <= pot <= P1:
+            stress_fact = 1.0
+        elif P1 < pot < P0:
+            stress_fact = (pot - P0) / (P1 - P0)
+        else:
+            stress_fact = 0.0
+        water_uptake[lyr] = stress_fact * root_fraction[lyr] * transp_pot
+
+
+def wofost_kernel(
+    water_content,
+    field_capacity,
+    perm_wilt_point,
+    layer_thickness,
+    p_value,
+    transp_pot,
+    root_fraction,
+    water_uptake,
+):
+    """WOFOST water uptake, root fraction over-written by layer thickness"""
+    total_layers = water_content.shape[0]
+    for lyr in range(total_layers):
+        root_fraction[lyr] = layer_thickness[lyr]
+        crit_soil_moist = (1 - p_value) * (
+            field_capacity[lyr] - perm_wilt_point[lyr]
+        ) + perm_wilt_point[lyr]
+        stress_fact = (water_content[lyr] - perm_wilt_point[lyr]) / (
+            crit_soil_moist - perm_wilt_point[lyr]
+        )
+        stress_fact = min(max(stress_fact, 0.0), 1.0)
+        water_uptake[lyr] = stress_fact * root_fraction[lyr] * transp_pot
+
+
+def epic_kernel(
+    water_content,
+    field_capacity,
+    perm_wilt_point,
+    layer_thickness,
+    cum_depth,
+    water_extraction_dist,
+    transp_pot,
+    water_uptake,
+):
+    """EPIC water uptake, carried down the profile as in epic_uptake_scan"""
+    WATER_DENSITY = 1000.0
+    CPWU = 0.5
+    TOS = 0.0
+    SCRP211 = 9.0
+    SCRP212 = 0.005
+    RD = 1.0
+    total_layers = water_content.shape[0]
+    dist_total = 1 - math.exp(-water_extraction_dist)
+    tot_water_uptake = 0.0
+    prev_depth_demand = 0.0
+    for lyr in range(total_layers):
+        depth_demand = (
+            transp_pot
+            * (1 - math.exp(-water_extraction_dist * cum_depth[lyr] / RD))
+            / dist_total
+        )
+        ST = water_content[lyr] * layer_thickness[lyr] * WATER_DENSITY
+        BLM = perm_wilt_point[lyr] * layer_thickness[lyr] * WATER_DENSITY
+        FC = field_capacity[lyr] * layer_thickness[lyr] * WATER_DENSITY
+        log_blm = math.log(BLM)
+        WTN = max(
+            5.0,
+            10
+            ** (
+                3.1761 - 1.6576 * ((math.log(ST) - log_blm) / (math.log(FC) - log_blm))
+            ),
+        )
+        XX = TOS + WTN
+        water_uptake[lyr] = 0.0
+        if XX < 5000:
+            F = 1 - XX / (XX + math.exp(SCRP211 - SCRP212 * XX))
+            uptake = (
+                min(
+                    depth_demand
+                    - CPWU * tot_water_uptake
+                    - (1.0 - CPWU) * prev_depth_demand,
+                    ST - BLM,
+                )
+                * F
+            )
+            if uptake > 0:
+                water_uptake[lyr] = uptake
+                tot_water_uptake += uptake
+        prev_depth_demand = depth_demand
+
+
+def finish_day(crop, transp_pot):
+    """Updates the crop transpiration after its water uptake"""
+    crop.att_transp = crop.water_uptake.sum()  # mm/day
+    crop.cum_transp += crop.att_transp
+    crop.expect_transp = transp_pot
+    crop.cum_pot_transp += crop.expect_transp
+    crop.transp_ratio = crop.att_transp / transp_pot
+
+
+def water_uptake_campbell(crop, soil):
+    """Compiled Crop.water_uptake_campbell"""
+    crop.pot_transp = soil.daily_ref_evap_transp * crop.light_intercpt
+    crop.max_pot_transp = crop.campbell_max_daily_transp * crop.light_intercpt
+    crop.expect_transp = min(crop.pot_transp, crop.max_pot_transp)  # mm/day
+    crop.bind_campbell()
+    if crop.campbell_tot_plant_hydr_cond > 0:
+        crop.att_transp = campbell_kernel(
+            soil.water_potential,
+            crop.campbell_root_cond_adj,
+            crop.campbell_plant_hydr_cond,
+            float(crop.campbell_tot_plant_hydr_cond),
+            float(crop.expect_transp),
+            float(crop.leaf_water_pot_stress_onset),
+            float(crop.leaf_water_pot_wilt_point),
+            crop.water_uptake,
+        )
+    crop.crop_transp = crop.water_uptake.sum()  # mm/day
+    crop.cum_transp += crop.crop_transp
+    crop.cum_pot_transp += crop.expect_transp
+    crop.transp_ratio = crop.crop_transp / crop.expect_transp
+
+
+def water_uptake_dssat(crop, soil):
+    """Compiled Crop.water_uptake_dssat"""
+    transp_pot = soil.daily_ref_evap_transp * crop.light_intercpt
+    dssat_kernel(
+        soil.water_content,
+        soil.perm_wilt_point,
+        soil.layer_thickness,
+        crop.root_dens,
+        float(crop.dssat_max_water_uptake),
+        float(transp_pot),
+        crop.water_uptake,
+    )
+    finish_day(crop, transp_pot)
+
+
+def water_uptake_apsim(crop, soil):
+    """Compiled Crop.water_uptake_apsim"""
+    transp_pot = soil.daily_ref_evap_transp * crop.light_intercpt
+    apsim_kernel(
+        soil.water_content,
+        soil.perm_wilt_point,
+        soil.layer_thickness,
+        soil.kl,
+        float(transp_pot),
+        crop.water_uptake,
+    )
+    finish_day(crop, transp_pot)
+
+
+def water_uptake_feddes(crop, soil):
+    """Compiled Crop.water_uptake_feddes"""
+    transp_pot = soil.daily_ref_evap_transp * crop.light_intercpt
+    feddes_kernel(
+        soil.water_potential,
+        crop.root_fraction,
+        float(transp_pot),
+        float(crop.P0),
+        float(soil.field_capacity_water_potential.mean()),
+        float(
+            feddes_stress_threshold(transp_pot, crop.P2L, crop.P2H, crop.R2H, crop.R2L)
+        ),
+        float(soil.perm_wilt_point_pot.mean()),
+        crop.water_uptake,
+    )
+    finish_day(crop, transp_pot)
+
+
+def water_uptake_wofost(crop, soil):
+    """Compiled Crop.water_uptake_wofost"""
+    DROUGHT_CAT = 4
+    transp_pot = soil.daily_ref_evap_transp * crop.light_intercpt
+    wofost_kernel(
+        soil.water_content,
+        soil.field_capacity,
+        soil.perm_wilt_point,
+        soil.layer_thickness,
+        float(p_wofost(transp_pot, DROUGHT_CAT)),
+        float(transp_pot),
+        crop.root_fraction,
+        crop.water_uptake,
+    )
+    # Root fraction changed in place
+    crop.campbell_key = None
+    finish_day(crop, transp_pot)
+
+
+def water_uptake_epic(crop, soil):
+    """Compiled Crop.water_uptake_epic"""
+    transp_pot = soil.daily_ref_evap_transp * crop.light_intercpt
+    epic_kernel(
+        soil.water_content,
+        soil.field_capacity,
+        soil.perm_wilt_point,
+        soil.layer_thickness,
+        soil.cum_depth,
+        float(crop.water_extraction_dist),
+        float(transp_pot),
+        crop.water_uptake,
+    )
+    finish_day(crop, transp_pot)
+
+
+# Compiled kernel of each model
+JIT_MODELS = {
+    "campbell": water_uptake_campbell,
+    "dssat": water_uptake_dssat,
+    "apsim": water_uptake_apsim,
+    "feddes": water_uptake_feddes,
+    "epic": water_uptake_epic,
+    "wofost": water_uptake_wofost,
+}
+
+
+# Python layer loop kernels, the water uptake functions above call the
+# module functions of these names
+PYTHON_KERNELS = {
+    "campbell_kernel": campbell_kernel,
+    "dssat_kernel": dssat_kernel,
+    "apsim_kernel": apsim_kernel,
+    "feddes_kernel": feddes_kernel,
+    "wofost_kernel": wofost_kernel,
+    "epic_kernel": epic_kernel,
+}
+# Numba compiled kernels, filled on first use
+COMPILED_KERNELS = {}
+
+
+def compiled_kernels():
+    """Returns the compiled kernels, Numba is imported and the kernels
+    compiled (or loaded from the Numba cache) on the first call"""
+    if not COMPILED_KERNELS:
+        from numba import njit
+
+        COMPILED_KERNELS.update(
+            (name, njit(cache=True)(kernel)) for name, kernel in PYTHON_KERNELS.items()
+        )
+    return COMPILED_KERNELS
+
+
+def compile_on_first_call(name):
+    """Returns a stand-in for a kernel that binds the compiled kernels on its
+    first call"""
+
+    def first_call(*args):
+        globals().update(compiled_kernels())
+        return globals()[name](*args)
+
+    return first_call
+
+
+def use_jit(enable=True):
+    """Selects the compiled kernels when Numba is available
+
+    enable: False restores the reference kernels
+
+    Returns True if the compiled kernels are in use
+    """
+    enable = enable and JIT_AVAILABLE
+    if enable:
+        globals().update((name, compile_on_first_call(name)) for name in PYTHON_KERNELS)
+    else:
+        globals().update(PYTHON_KERNELS)
+    for model in JIT_MODELS:
+        register_model(model, JIT_MODELS[model] if enable else REFERENCE_MODELS[model])
+    return enable
+
+
+def compare_backends(sim_inputs, sim_days=365, models=None):
+    """Runs the reference and the compiled kernels from the same initial
+    state and returns the largest deviations of each model
+
+    sim_inputs: parsed simulation inputs (see inputs.load_inputs)
+    sim_days: simulated days
+    models: models to compare (default: all of them)
+
+    Returns {model: (max abs deviation, max relative deviation)} of the daily
+    water uptake, transpiration and soil water content
+
+    >>> from benchmarks import synthetic_inputs
+    >>> from inputs import TextBook, parse_book
+    >>> sim_inputs = parse_book(TextBook(synthetic_inputs(20, 60)))
+    >>> for jit in [True, False]:
+    ...     _ = use_jit(jit)
+    ...     deviations = compare_backends(sim_inputs, 60)
+    ...     print(all(max_rel <= TOLERANCE for _, max_rel in deviations.values()))
+    True
+    True
+    """
+    deviations = {}
+    for model in models or list(JIT_MODELS):
+        runs = []
+        for kernel in [REFERENCE_MODELS[model], JIT_MODELS[model]]:
+            soil = sim_inputs.soil_spec.fresh_state()
+            crop = sim_inputs.crop_spec.fresh_state()
+            crop.light_intercpt = 1
+            runs.append((kernel, crop, soil))
+        max_abs = max_rel = 0
+        for _ in range(sim_days):
+            values = []
+            scales = []
+            for kernel, crop, soil in runs:
+                kernel(crop, soil)
+                soil.update_water_content([crop])
+                values.append(
+                    np.concatenate(
+                        [
+                            crop.water_uptake,
+                            soil.water_content,
+                            [crop.cum_transp, crop.cum_pot_transp, crop.transp_ratio],
+                        ]
+                    )
+                )
+                # Water uptake deviations relative to the largest layer uptake
+                scales.append(
+                    np.concatenate(
+                        [
+                            np.full(soil.total_layers, np.abs(crop.water_uptake).max()),
+                            np.abs(values[-1][soil.total_layers :]),
+                        ]
+                    )
+                )
+            diff = np.abs(values[0] - values[1])
+            scale = np.maximum(scales[0], np.finfo(float).tiny)
+            max_abs = max(max_abs, diff.max())
+            max_rel = max(max_rel, (diff / scale).max())
+        deviations[model] = (max_abs, max_rel)
+    return deviations
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Checks the compiled kernels against the reference kernels"
+    )
+    parser.add_argument("input_file", nargs="?", default="sim_data.xls")
+    parser.add_argument("--days", type=int, default=365)
+    args = parser.parse_args()
+    if not JIT_AVAILABLE:
+        print("Numba is not installed, the compiled kernels run as Python code")
+    from inputs import load_inputs
+
+    deviations = compare_backends(load_inputs(args.input_file, None), args.days)
+    failed = False
+    for model, (max_abs, max_rel) in deviations.items():
+        status = "ok" if max_rel <= TOLERANCE else "FAILED"
+        failed = failed or status != "ok"
+        print("%-8s max abs %.3e  max rel %.3e  %s" % (model, max_abs, max_rel, status))
+    sys.exit(failed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""Opt-in timers and call counters of the simulation stages
+
+StageProfiler.instrument wraps the water uptake kernel, the soil water
+update and the outputs of a model run with timers, so that runs without
+profiling are not slowed down at all. The totals are printed as a table and
+exported as JSON or as a Chrome trace (chrome://tracing, Perfetto).
+"""
+from __future__ import division
+import json
+import time
+from collections import defaultdict
+
+# Stages of a model run and the objects and methods they time
+STAGES = {
+    "uptake": (None, "water_uptake"),
+    "soil_update": ("soil", "update_water_content"),
+    "output_daily": ("output", "daily"),
+    "output_fill": ("output", "fill"),
+    "save_data": ("output", "save_data"),
+}
+# Events kept for the trace, the totals count every call
+MAX_TRACE_EVENTS = 1000000
+
+
+class StageProfiler(object):
+    """Total time and number of calls of each model and stage
+
+    max_trace_events: number of calls kept as trace events
+    """
+
+    def __init__(self, max_trace_events=MAX_TRACE_EVENTS):
+        self.clock = time.perf_counter
+        self.start = self.clock()
+        self.totals = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.events = []
+        self.max_trace_events = max_trace_events
+
+    def record(self, key, start, end):
+        """Adds a call of a (model, stage) key"""
+        self.totals[key] += end - start
+        self.calls[key] += 1
+        if len(self.events) < self.max_trace_events:
+            self.events.append((key, start, end))
+
+    def wrap(self, model, stage, function):
+        """Returns the function timed as a stage of a model"""
+        key = (model, stage)
+        clock = self.clock
+        record = self.record
+
+        def timed(*args, **kwargs):
+            start = clock()
+            result = function(*args, **kwargs)
+            record(key, start, clock())
+            return result
+
+        return timed
+
+    def instrument(self, run):
+        """Times the STAGES of a Model_water.ModelRun"""
+        for stage, (owner, method) in STAGES.items():
+            target = run if owner is None else getattr(run, owner)
+            if hasattr(target, method):
+                setattr(
+                    target, method, self.wrap(run.model, stage, getattr(target, method))
+                )
+
+    def timer(self, model, stage):
+        """Returns a context manager that times a block as a stage, for
+        stages outside the daily loop"""
+        return StageTimer(self, (model, stage))
+
+    def rows(self):
+        """Returns (model, stage, calls, total s, mean s, share of the wall
+        time) of each stage, slowest first"""
+        wall_time = self.clock() - self.start
+        return [
+            (
+                model,
+                stage,
+                self.calls[(model, stage)],
+                total,
+                total / self.calls[(model, stage)],
+                total / wall_time,
+            )
+            for (model, stage), total in sorted(
+                self.totals.items(), key=lambda item: -item[1]
+            )
+        ]
+
+    def summary(self):
+        """Returns the table of the stage times"""
+        lines = [
+            "%-10s %-14s %9s %12s %12s %7s"
+            % ("model", "stage", "calls", "total ms", "mean us", "share")
+        ]
+        for model, stage, calls, total, mean, share in self.rows():
+            lines.append(
+                "%-10s %-14s %9d %12.2f %12.2f %6.1f%%"
+                % (model, stage, calls, total * 1e3, mean * 1e6, share * 100)
+            )
+        lines.append("wall time %.2f ms" % ((self.clock() - self.start) * 1e3))
+        return "\n".join(lines)
+
+    def report(self):
+        """Returns the stage times as a JSON serializable dictionary"""
+        return {
+            "wall_time": self.clock() - self.start,
+            "stages": [
+                {
+                    "model": model,
+                    "stage": stage,
+                    "calls": calls,
+                    "total": total,
+                    "mean": mean,
+                }
+                for model, stage, calls, total, mean, _ in self.rows()
+            ],
+        }
+
+    def save_json(self, fname):
+        """Saves the stage times in a JSON file"""
+        with open(fname, "w") as json_file:
+            json.dump(self.report(), json_file, indent=2)
+
+    def save_trace(self, fname):
+        """Saves the timed calls in the Chrome trace event format, one
+        thread per model"""
+        threads = {}
+        trace_events = []
+        for (model, stage), start, end in self.events:
+            thread = threads.setdefault(model, len(threads))
+            trace_events.append(
+                {
+                    "name": stage,
+                    "cat": model,
+                    "ph": "X",
+                    "ts": (start - self.start) * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "pid": 0,
+                    "tid": thread,
+                }
+            )
+        for model, thread in threads.items():
+            trace_events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": 0,
+                    "tid": thread,
+                    "args": {"name": model},
+                }
+            )
+        with open(fname, "w") as trace_file:
+            json.dump({"traceEvents": trace_events}, trace_file)
+
+
+class StageTimer(object):
+    """Times a block of code as a stage of a StageProfiler"""
+
+    def __init__(self, profiler, key):
+        self.profiler = profiler
+        self.key = key
+
+    def __enter__(self):
+        self.start = self.profiler.clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.key, self.start, self.profiler.clock())
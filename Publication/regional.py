@@ -0,0 +1,338 @@
+"""Runs the water uptake models over a grid of cells, each with its own soil
+profile and weather
+
+The cells are listed in a csv file with the CELL_COLUMNS, the soils are
+read from a soil store (see soil_store) and the crop and simulation dates
+from a base input file. The crop roots are moved to the layers of each cell
+soil (see horizons.regrid). The grid is split in square tiles, each tile is
+run by a worker process as Ensemble (cells x layers) arrays and saved in its
+own npz file. A manifest in the output folder records the finished tiles so
+that an interrupted job resumes with the tiles left:
+
+    python regional.py cells.csv soils.sqlite sim_data.xls --tile-size 32
+"""
+#!/usr/bin/env python
+from __future__ import division
+import argparse
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+
+import numpy as np
+
+from Ensemble_class import UPTAKE_MODELS, Ensemble
+from horizons import regrid
+from inputs import load_inputs
+from Model_water import sim_calendar
+from soil_store import SoilStore
+from weather import daily_ref_evap_transp, load_weather, sim_day_values
+
+# Columns of the cells csv file, the weather file is relative to the csv
+# file, latitude and elevation are only needed to compute the reference
+# evapotranspiration from raw weather
+CELL_COLUMNS = ["row", "col", "profile_id", "weather", "latitude", "elevation"]
+# Daily outputs saved for each model, (days, cells) arrays
+OUTPUTS = [
+    "att_transp",
+    "expect_transp",
+    "transp_ratio",
+    "cum_transp",
+    "cum_pot_transp",
+]
+MANIFEST = "manifest.json"
+
+
+def read_cells(fname):
+    """Returns the cells of a cells csv file as a list of dictionaries"""
+    folder = os.path.dirname(fname)
+    with open(fname, newline="") as cells_file:
+        cells = list(csv.DictReader(cells_file))
+    for cell in cells:
+        cell["row"] = int(cell["row"])
+        cell["col"] = int(cell["col"])
+        cell["weather"] = os.path.join(folder, cell["weather"])
+        for name in ["latitude", "elevation"]:
+            cell[name] = float(cell[name]) if cell.get(name) else None
+    return cells
+
+
+def split_tiles(cells, tile_size):
+    """Returns a dictionary of tile ids and the cells of each tile
+
+    >>> cells = [{"row": row, "col": col} for row in range(3) for col in range(3)]
+    >>> {tile: len(tile_cells) for tile, tile_cells in split_tiles(cells, 2).items()}
+    {'0_0': 4, '0_1': 2, '1_0': 2, '1_1': 1}
+    """
+    tiles = {}
+    for cell in cells:
+        tile = "%d_%d" % (cell["row"] // tile_size, cell["col"] // tile_size)
+        tiles.setdefault(tile, []).append(cell)
+    return tiles
+
+
+@lru_cache(maxsize=None)
+def load_base(input_file):
+    """Returns the base crop and soil and the simulation calendar, once in
+    each worker process"""
+    sim_inputs = load_inputs(input_file)
+    return (
+        sim_inputs.crop_spec.fresh_state(),
+        sim_inputs.soil_spec.soil,
+        sim_calendar(sim_inputs),
+    )
+
+
+@lru_cache(maxsize=None)
+def open_store(store_file):
+    """Opens the soil store once in each worker process"""
+    return SoilStore(store_file)
+
+
+@lru_cache(maxsize=None)
+def weather_ref_evap_transp(weather_file, latitude, elevation, input_file):
+    """Returns the reference evapotranspiration of a weather file on the
+    simulation days, computed once for the cells that share the file"""
+    _, _, (years, days_of_year) = load_base(input_file)
+    weather = load_weather(weather_file)
+    return sim_day_values(
+        weather,
+        daily_ref_evap_transp(weather, latitude, elevation),
+        years,
+        days_of_year,
+    )
+
+
+def cell_crop(base_crop, base_soil, soil):
+    """Returns a copy of the base crop with its roots moved to the layers of
+    a cell soil"""
+    crop = base_crop.clone()
+    roots = regrid(
+        {"cum_depth": base_soil.cum_depth, "root_dens": base_crop.root_dens},
+        soil.layer_thickness,
+        soil.cum_depth,
+    )
+    crop.root_dens = roots["root_dens"]
+    crop.root_fraction = roots["root_fraction"]
+    crop.conductance = np.ones(soil.total_layers)
+    crop.water_uptake = np.zeros(soil.total_layers)
+    crop.leaf_water_potential = np.zeros(soil.total_layers)
+    # All solar radiation intercepted by canopy
+    crop.light_intercpt = 1
+    return crop
+
+
+def run_tile(task):
+    """Runs the cells of one tile and saves their outputs
+
+    task: (tile id, cells, soil store file, base input file, models, tile
+     file, float type name of the ensembles)
+
+    Returns the tile id and the number of cells
+    """
+    tile, cells, store_file, input_file, models, tile_file, dtype = task
+    base_crop, base_soil, (years, _) = load_base(input_file)
+    sim_days = len(years)
+    specs = open_store(store_file).get_many([cell["profile_id"] for cell in cells])
+    soils = [specs[cell["profile_id"]].fresh_state() for cell in cells]
+    ref_evap_transp = np.array(
+        [
+            weather_ref_evap_transp(
+                cell["weather"], cell["latitude"], cell["elevation"], input_file
+            )
+            for cell in cells
+        ]
+    ).T
+    outputs = {
+        "row": np.array([cell["row"] for cell in cells]),
+        "col": np.array([cell["col"] for cell in cells]),
+        "profile_id": np.array([cell["profile_id"] for cell in cells]),
+    }
+    for model in models:
+        for name in OUTPUTS:
+            outputs["%s_%s" % (model, name)] = np.zeros((sim_days, len(cells)))
+    # One ensemble for the cells of each number of layers
+    total_layers = np.array([soil.total_layers for soil in soils])
+    for layers in np.unique(total_layers):
+        group = np.flatnonzero(total_layers == layers)
+        ensemble = Ensemble(
+            [soils[i] for i in group],
+            [cell_crop(base_crop, base_soil, soils[i]) for i in group],
+            dtype,
+        )
+        for model in models:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                results = ensemble.copy().run(
+                    model, sim_days, ref_evap_transp[:, group]
+                )
+            for name in OUTPUTS:
+                outputs["%s_%s" % (model, name)][:, group] = results[name]
+    # Written under a temporary name so that an interrupted tile is not
+    # taken for a finished one
+    np.savez(tile_file + ".tmp.npz", **outputs)
+    os.replace(tile_file + ".tmp.npz", tile_file)
+    return tile, len(cells)
+
+
+def read_manifest(output_dir):
+    """Returns the manifest of a regional job, empty if it has not started"""
+    fname = os.path.join(output_dir, MANIFEST)
+    if not os.path.exists(fname):
+        return {"job": None, "tiles": {}}
+    with open(fname) as manifest_file:
+        return json.load(manifest_file)
+
+
+def write_manifest(output_dir, manifest):
+    """Saves the manifest of a regional job, replacing it at once"""
+    fname = os.path.join(output_dir, MANIFEST)
+    with open(fname + ".tmp", "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.replace(fname + ".tmp", fname)
+
+
+def run_regional(
+    cells_file,
+    store_file,
+    input_file,
+    output_dir,
+    tile_size=32,
+    models=None,
+    workers=None,
+    dtype="float64",
+):
+    """Runs the tiles of a grid that are not finished yet
+
+    cells_file: csv file of the grid cells (see CELL_COLUMNS)
+    store_file: soil store with the profile of each cell
+    input_file: base input file with the crop and simulation dates
+    output_dir: folder of the tile files and manifest
+    tile_size: rows and columns of cells in a tile
+    models: names of the UPTAKE_MODELS to run (default: all of them)
+    workers: number of worker processes (default: number of CPUs)
+    dtype: float type name of the ensemble arrays, "float32" halves their
+     memory (see Ensemble_class.precision_report)
+
+    Returns the manifest
+    """
+    if models is None:
+        models = list(UPTAKE_MODELS)
+    for model in models:
+        assert model in UPTAKE_MODELS, "unknown water uptake model %s" % model
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    job = {
+        "cells": os.path.abspath(cells_file),
+        "store": os.path.abspath(store_file),
+        "input": os.path.abspath(input_file),
+        "tile_size": tile_size,
+        "models": models,
+        "dtype": dtype,
+    }
+    manifest = read_manifest(output_dir)
+    assert manifest["job"] in (None, job), (
+        "%s holds another regional job, use a new output folder" % output_dir
+    )
+    manifest["job"] = job
+    tiles = split_tiles(read_cells(cells_file), tile_size)
+    tasks = [
+        (
+            tile,
+            cells,
+            store_file,
+            input_file,
+            models,
+            os.path.join(output_dir, "tile_%s.npz" % tile),
+            dtype,
+        )
+        for tile, cells in sorted(tiles.items())
+        if tile not in manifest["tiles"]
+        or not os.path.exists(os.path.join(output_dir, manifest["tiles"][tile]["file"]))
+    ]
+    write_manifest(output_dir, manifest)
+    # Input and weather caches filled once here rather than by every worker
+    # at the same time
+    load_inputs(input_file)
+    for weather_file in sorted({cell["weather"] for task in tasks for cell in task[1]}):
+        load_weather(weather_file)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_tile, task) for task in tasks]
+        for future in as_completed(futures):
+            tile, total_cells = future.result()
+            manifest["tiles"][tile] = {
+                "file": "tile_%s.npz" % tile,
+                "cells": total_cells,
+            }
+            write_manifest(output_dir, manifest)
+    return manifest
+
+
+def mosaic(output_dir, model, name="cum_transp", day=-1):
+    """Returns a raster of one output of the finished tiles on one day, NaN
+    where there is no cell
+
+    model: one of the models of the job
+    name: one of OUTPUTS
+    day: index of the simulation day (default: the last one)
+    """
+    manifest = read_manifest(output_dir)
+    tiles = []
+    for tile in manifest["tiles"].values():
+        with np.load(os.path.join(output_dir, tile["file"])) as tile_file:
+            tiles.append(
+                (
+                    tile_file["row"],
+                    tile_file["col"],
+                    tile_file["%s_%s" % (model, name)][day],
+                )
+            )
+    total_rows = max(rows.max() for rows, _, _ in tiles) + 1
+    total_cols = max(cols.max() for _, cols, _ in tiles) + 1
+    raster = np.full((total_rows, total_cols), np.nan)
+    for rows, cols, values in tiles:
+        raster[rows, cols] = values
+    return raster
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("cells", help="csv file of the grid cells")
+    parser.add_argument("store", help="soil store with the cell profiles")
+    parser.add_argument("input_file", help="base input file, crop and dates")
+    parser.add_argument("--output-dir", default="regional_output")
+    parser.add_argument("--tile-size", type=int, default=32)
+    parser.add_argument(
+        "--models",
+        type=lambda text: text.split(","),
+        default=None,
+        help="comma separated models to run (default: all)",
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--float32",
+        action="store_true",
+        help="run the tiles in single precision, half the memory",
+    )
+    args = parser.parse_args()
+    manifest = run_regional(
+        args.cells,
+        args.store,
+        args.input_file,
+        args.output_dir,
+        args.tile_size,
+        args.models,
+        args.workers,
+        "float32" if args.float32 else "float64",
+    )
+    print(
+        "%d tiles, %d cells"
+        % (
+            len(manifest["tiles"]),
+            sum(tile["cells"] for tile in manifest["tiles"].values()),
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""Content-addressed cache of whole simulation results
+
+The key of a simulation is the hash of its parsed inputs (soil and crop
+specs, dates and daily weather), its options (models, outputs), the code
+of the simulation modules and the kernels in use. A cache entry holds the
+season totals and the output files of each model, so an identical run
+copies them instead of simulating again. The least recently used entries
+are removed once the cache is larger than its size limit.
+
+    python result_cache.py list
+    python result_cache.py invalidate KEY [KEY ...]
+    python result_cache.py clear
+"""
+#!/usr/bin/env python
+from __future__ import division
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from Crop_class import UPTAKE_MODELS
+from Model_water import OUTPUT_NAMES, simulate
+
+CACHE_DIR = ".result_cache"
+# Changed when the entry layout changes
+CACHE_VERSION = 1
+MAX_BYTES = 500 * 1024**2
+# Modules whose code changes the simulation results
+SIMULATION_MODULES = [
+    "Model_water.py",
+    "Crop_class.py",
+    "Soil_class.py",
+    "functions.py",
+    "Print_class.py",
+    "jit_backend.py",
+]
+SUMMARY = "summary.json"
+# Entries being stored, left behind by runs killed while storing
+TEMP_PREFIX = ".tmp_"
+# Age of a temporary entry after which its run is taken for dead, s
+STALE_SECONDS = 3600
+
+
+def hash_value(key, value):
+    """Adds a parsed input value to a hash: arrays by their dtype, shape and
+    bytes, objects by their class and attributes
+
+    >>> def digest(value):
+    ...     key = hashlib.sha256()
+    ...     hash_value(key, value)
+    ...     return key.hexdigest()
+    >>> digest({"a": np.arange(3.0)}) == digest({"a": np.arange(3.0)})
+    True
+    >>> digest({"a": np.arange(3.0)}) == digest({"a": np.arange(3)})
+    False
+    """
+    if isinstance(value, np.ndarray):
+        key.update(b"array %s %r " % (value.dtype.str.encode(), value.shape))
+        key.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        key.update(b"dict %d " % len(value))
+        for name in sorted(value, key=repr):
+            hash_value(key, name)
+            hash_value(key, value[name])
+    elif isinstance(value, (list, tuple)):
+        key.update(b"list %d " % len(value))
+        for item in value:
+            hash_value(key, item)
+    elif hasattr(value, "__dict__"):
+        key.update(b"object %s " % type(value).__name__.encode())
+        hash_value(key, vars(value))
+    else:
+        key.update(b"%s %r " % (type(value).__name__.encode(), value))
+
+
+def code_version():
+    """Returns the hash of the simulation code and of the kernels in use"""
+    key = hashlib.sha256()
+    folder = os.path.dirname(os.path.abspath(__file__))
+    for module in SIMULATION_MODULES:
+        with open(os.path.join(folder, module), "rb") as source:
+            key.update(source.read())
+    # Compiled and reference kernels differ in the last digits
+    for model, kernel in sorted(UPTAKE_MODELS.items()):
+        key.update(("%s %s.%s " % (model, kernel.__module__, kernel.__name__)).encode())
+    key.update(("numpy %s" % np.__version__).encode())
+    return key.hexdigest()
+
+
+def simulation_key(sim_inputs, options, ref_evap_transp=None):
+    """Returns the cache key of a simulation
+
+    options: dictionary of the simulate options that change the results
+    ref_evap_transp: daily reference evapotranspiration, if any
+    """
+    key = hashlib.sha256(b"result cache %d " % CACHE_VERSION)
+    hash_value(
+        key,
+        [
+            sim_inputs.start_day,
+            sim_inputs.end_day,
+            sim_inputs.start_year,
+            sim_inputs.end_year,
+            sim_inputs.soil_spec.soil,
+            sim_inputs.crop_spec.crop,
+            options,
+            None if ref_evap_transp is None else np.asarray(ref_evap_transp, float),
+            code_version(),
+        ],
+    )
+    return key.hexdigest()
+
+
+def output_files(models, chunk_size):
+    """Returns the output file names of the models of a simulation"""
+    files = []
+    for model in models:
+        name = OUTPUT_NAMES.get(model, model + "_output")
+        if chunk_size:
+            files.extend([name + "_crop.csv", name + "_soil.csv"])
+        else:
+            files.append(name + ".xls")
+    return files
+
+
+def cached_simulate(
+    sim_inputs,
+    output_dir=".",
+    chunk_size=None,
+    models=None,
+    skip_idle=True,
+    ref_evap_transp=None,
+    cache_dir=CACHE_DIR,
+    max_bytes=MAX_BYTES,
+):
+    """Runs Model_water.simulate, or copies its results from the cache
+
+    cache_dir: folder of the result cache
+    max_bytes: size of the cache above which the least recently used
+     entries are removed
+    The other arguments are those of Model_water.simulate.
+
+    Returns the cumulative transpiration of each model
+    """
+    if models is None:
+        models = list(UPTAKE_MODELS)
+    options = {
+        "models": list(models),
+        "chunk_size": chunk_size,
+        "skip_idle": skip_idle,
+        "saved": output_dir is not None,
+    }
+    key = simulation_key(sim_inputs, options, ref_evap_transp)
+    files = output_files(models, chunk_size) if output_dir is not None else []
+    entry = os.path.join(cache_dir, key)
+    if os.path.exists(os.path.join(entry, SUMMARY)):
+        for fname in files:
+            shutil.copyfile(os.path.join(entry, fname), os.path.join(output_dir, fname))
+        # Last use of the entry, for the LRU eviction
+        os.utime(os.path.join(entry, SUMMARY))
+        with open(os.path.join(entry, SUMMARY)) as summary_file:
+            return json.load(summary_file)["summaries"]
+    summaries = simulate(
+        sim_inputs,
+        output_dir,
+        chunk_size=chunk_size,
+        models=models,
+        skip_idle=skip_idle,
+        ref_evap_transp=ref_evap_transp,
+    )
+    store(cache_dir, key, summaries, output_dir, files)
+    evict(cache_dir, max_bytes)
+    return summaries
+
+
+def store(cache_dir, key, summaries, output_dir, files):
+    """Adds the results of a simulation to the cache"""
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    # Filled under a temporary name, concurrent runs of the same simulation
+    # keep the first entry
+    temp_entry = tempfile.mkdtemp(dir=cache_dir, prefix=TEMP_PREFIX)
+    for fname in files:
+        shutil.copyfile(
+            os.path.join(output_dir, fname), os.path.join(temp_entry, fname)
+        )
+    with open(os.path.join(temp_entry, SUMMARY), "w") as summary_file:
+        json.dump(
+            {"summaries": summaries, "files": files, "created": time.time()},
+            summary_file,
+        )
+    try:
+        os.rename(temp_entry, os.path.join(cache_dir, key))
+    except OSError:
+        shutil.rmtree(temp_entry)
+
+
+def entries(cache_dir=CACHE_DIR):
+    """Returns (key, bytes, last use) of the cache entries, least recently
+    used first"""
+    if not os.path.isdir(cache_dir):
+        return []
+    found = []
+    for key in os.listdir(cache_dir):
+        summary = os.path.join(cache_dir, key, SUMMARY)
+        if key.startswith(".") or not os.path.exists(summary):
+            continue
+        entry = os.path.join(cache_dir, key)
+        size = sum(
+            os.path.getsize(os.path.join(entry, fname)) for fname in os.listdir(entry)
+        )
+        found.append((key, size, os.path.getmtime(summary)))
+    return sorted(found, key=lambda item: item[2])
+
+
+def remove_stale(cache_dir=CACHE_DIR, max_age=STALE_SECONDS):
+    """Removes the temporary entries older than max_age seconds, those of
+    runs killed while storing their results"""
+    if not os.path.isdir(cache_dir):
+        return
+    now = time.time()
+    for name in os.listdir(cache_dir):
+        if not name.startswith(TEMP_PREFIX):
+            continue
+        temp_entry = os.path.join(cache_dir, name)
+        try:
+            age = now - os.path.getmtime(temp_entry)
+        except OSError:
+            # Stored or removed by another process meanwhile
+            continue
+        if age > max_age:
+            shutil.rmtree(temp_entry, ignore_errors=True)
+
+
+def evict(cache_dir=CACHE_DIR, max_bytes=MAX_BYTES):
+    """Removes the stale temporary entries and the least recently used
+    entries until the cache is not larger than max_bytes, the most recent
+    entry is always kept"""
+    remove_stale(cache_dir)
+    cache_entries = entries(cache_dir)
+    total = sum(size for _, size, _ in cache_entries)
+    for key, size, _ in cache_entries[:-1]:
+        if total <= max_bytes:
+            break
+        invalidate([key], cache_dir)
+        total -= size
+
+
+def invalidate(keys, cache_dir=CACHE_DIR):
+    """Removes cache entries, keys may be abbreviated to a unique prefix"""
+    all_keys = [key for key, _, _ in entries(cache_dir)]
+    for key in keys:
+        matches = [full_key for full_key in all_keys if full_key.startswith(key)]
+        assert len(matches) == 1, "%d cache entries match %s" % (len(matches), key)
+        shutil.rmtree(os.path.join(cache_dir, matches[0]))
+
+
+def clear(cache_dir=CACHE_DIR):
+    """Removes every entry and the stale temporary entries, the entries
+    being stored by running simulations are kept"""
+    invalidate([key for key, _, _ in entries(cache_dir)], cache_dir)
+    remove_stale(cache_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("command", choices=["list", "invalidate", "clear"])
+    parser.add_argument("keys", nargs="*", help="entries to invalidate")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    args = parser.parse_args()
+    if args.command == "list":
+        cache_entries = entries(args.cache_dir)
+        for key, size, last_use in cache_entries:
+            print(
+                "%s %10d %s"
+                % (key, size, time.strftime("%Y-%m-%d %H:%M", time.localtime(last_use)))
+            )
+        print(
+            "%d entries, %d bytes"
+            % (len(cache_entries), sum(size for _, size, _ in cache_entries))
+        )
+    elif args.command == "invalidate":
+        invalidate(args.keys, args.cache_dir)
+    else:
+        clear(args.cache_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Snapshots of the simulation state of a crop and soil pair
+
+A snapshot holds the values that change during a simulation (Crop.state
+and Soil.state) and the simulation day, as compact npz bytes or files. A
+run can be saved mid-season and resumed later, or a spun-up state can be
+forked into many what-if branches instead of simulating the common days
+again for each of them:
+
+    state = capture(crop, soil, sim_day)
+    branches = fork(crop, soil, 100)      # independent copies
+    restore(crop, soil, state)            # back to the saved day
+
+The branches can also be run together as an Ensemble_class.Ensemble.
+"""
+from __future__ import division
+import io
+
+import numpy as np
+
+# Changed when the snapshot contents change, older snapshots are rejected
+SNAPSHOT_VERSION = 1
+
+
+def capture(crop, soil, sim_day=0):
+    """Returns the state of a crop and soil pair as a dictionary of arrays
+
+    sim_day: last simulated day, kept with the state
+    """
+    state = {"version": SNAPSHOT_VERSION, "sim_day": sim_day}
+    state.update(("crop." + name, value) for name, value in crop.state().items())
+    state.update(("soil." + name, value) for name, value in soil.state().items())
+    return {name: np.asarray(value) for name, value in state.items()}
+
+
+def restore(crop, soil, state):
+    """Sets a crop and soil pair to a captured state
+
+    The crop and soil must have the layers of the captured ones, e.g. fresh
+    states of the same specs.
+
+    Returns the simulation day of the state
+    """
+    assert int(state["version"]) == SNAPSHOT_VERSION, (
+        "snapshot version %d, expected %d" % (state["version"], SNAPSHOT_VERSION)
+    )
+    values = {}
+    for name, value in state.items():
+        value = np.asarray(value)
+        # Scalars are back as the Python numbers of the simulation
+        values[name] = value.item() if value.ndim == 0 else value
+    crop.restore(
+        {name[5:]: value for name, value in values.items() if name.startswith("crop.")}
+    )
+    soil.restore(
+        {name[5:]: value for name, value in values.items() if name.startswith("soil.")}
+    )
+    return values["sim_day"]
+
+
+def to_bytes(state):
+    """Returns a captured state as npz bytes
+
+    >>> state = {"version": np.asarray(1), "soil.water_content": np.ones(3)}
+    >>> from_bytes(to_bytes(state))["soil.water_content"]
+    array([1., 1., 1.])
+    """
+    data = io.BytesIO()
+    np.savez(data, **state)
+    return data.getvalue()
+
+
+def from_bytes(data):
+    """Returns the state of npz bytes, see to_bytes"""
+    with np.load(io.BytesIO(data)) as arrays:
+        return dict(arrays)
+
+
+def save(fname, state):
+    """Saves a captured state in an npz file"""
+    with open(fname, "wb") as snapshot_file:
+        snapshot_file.write(to_bytes(state))
+
+
+def load(fname):
+    """Returns the state saved in an npz file"""
+    with open(fname, "rb") as snapshot_file:
+        return from_bytes(snapshot_file.read())
+
+
+def fork(crop, soil, copies):
+    """Returns independent copies of a crop and soil pair in their current
+    state, as (crop, soil) pairs that share the read-only properties"""
+    return [(crop.clone(), soil.clone()) for _ in range(copies)]
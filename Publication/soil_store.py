@@ -0,0 +1,222 @@
+"""Local soil profile store: keeps the soil properties derived by
+Soil_class.soil_properties in a SQLite file, indexed by profile id and by
+texture class, so that jobs load ready-to-run soils without deriving them
+again"""
+#!/usr/bin/env python
+from __future__ import division
+import argparse
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+from functions import texture_class
+from Soil_class import Soil, SoilSpec, build_soils
+
+# Layer arrays of a soil, stored as one (arrays, layers) float64 blob
+SOIL_ARRAYS = [
+    "layer_thickness",
+    "cum_depth",
+    "clay",
+    "sand",
+    "organic_matter",
+    "bulk_density",
+    "field_capacity",
+    "perm_wilt_point",
+    "kl",
+    "init_plant_avail_water",
+    "porosity",
+    "b_value",
+    "air_entry_potential",
+    "field_capacity_water_potential",
+    "plant_avail_water",
+    "water_content",
+    "init_water_avail",
+    "water_potential",
+    "perm_wilt_point_pot",
+    "sat_water_potential",
+]
+# Changed when the stored properties change, older stores are rejected
+STORE_VERSION = 1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    profile_id TEXT PRIMARY KEY,
+    texture_class TEXT NOT NULL,
+    total_layers INTEGER NOT NULL,
+    daily_ref_evap_transp NUMERIC NOT NULL,
+    mean_field_capacity REAL NOT NULL,
+    manual TEXT NOT NULL,
+    arrays BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS profiles_texture ON profiles (texture_class);
+"""
+COLUMNS = (
+    "profile_id, texture_class, total_layers, daily_ref_evap_transp, "
+    "mean_field_capacity, manual, arrays"
+)
+
+
+def profile_texture(soil):
+    """Returns the texture class of the thickness weighted profile texture"""
+    weights = soil.layer_thickness / soil.layer_thickness.sum()
+    return texture_class(
+        float((soil.clay * weights).sum() * 100),
+        float((soil.sand * weights).sum() * 100),
+    )
+
+
+def soil_row(profile_id, soil):
+    """Returns the profiles table row of a soil"""
+    manual = {
+        "organic_matter": soil.manual_organic_matter,
+        "bulk_density": soil.manual_bulk_density,
+        "field_capacity": soil.manual_field_capacity,
+        "perm_wilt_point": soil.manual_permanent_wilt_point,
+    }
+    arrays = np.stack([getattr(soil, name) for name in SOIL_ARRAYS])
+    return (
+        profile_id,
+        profile_texture(soil),
+        soil.total_layers,
+        np.asarray(soil.daily_ref_evap_transp).item(),
+        float(soil.mean_field_capacity),
+        json.dumps({name: bool(value) for name, value in manual.items()}),
+        arrays.astype(np.float64).tobytes(),
+    )
+
+
+def row_spec(row):
+    """Returns the soil spec of a profiles table row"""
+    _, _, total_layers, daily_ref_evap_transp, mean_field_capacity = row[:5]
+    arrays = np.frombuffer(row[6], dtype=np.float64).reshape(-1, total_layers)
+    props = dict(zip(SOIL_ARRAYS, arrays))
+    props["mean_field_capacity"] = mean_field_capacity
+    soil = Soil.from_properties(props, daily_ref_evap_transp, json.loads(row[5]))
+    return SoilSpec.from_soil(soil)
+
+
+class SoilStore(object):
+    """SQLite store of derived soil profiles
+
+    fname: database file, created if missing (":memory:" for a temporary
+     store)
+    """
+
+    def __init__(self, fname):
+        self.connection = sqlite3.connect(fname)
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        assert version in (0, STORE_VERSION), (
+            "soil store %s has version %d, expected %d"
+            % (fname, version, STORE_VERSION)
+        )
+        if version == 0:
+            self.connection.executescript(SCHEMA)
+            self.connection.execute("PRAGMA user_version = %d" % STORE_VERSION)
+
+    def close(self):
+        self.connection.close()
+
+    def add(self, profile_id, soil):
+        """Stores a soil, replacing a profile with the same id"""
+        self.add_soils({profile_id: soil})
+
+    def add_soils(self, soils):
+        """Stores a dictionary of profile ids and soils in one transaction"""
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO profiles (%s) VALUES (?, ?, ?, ?, ?, ?, ?)"
+                % COLUMNS,
+                [soil_row(profile_id, soil) for profile_id, soil in soils.items()],
+            )
+
+    def add_layers(self, profile_ids, layers, daily_ref_evap_transp):
+        """Derives and stores the profiles of a soil database in one pass
+
+        profile_ids: id of each profile
+        layers: dictionary of LAYER_COLUMNS arrays shaped (profiles, layers),
+         see Soil_class.build_soils
+        daily_ref_evap_transp: reference evapotranspiration, mm/d, one value or
+         one value per profile
+        """
+        self.add_soils(
+            dict(zip(profile_ids, build_soils(layers, daily_ref_evap_transp)))
+        )
+
+    def get(self, profile_id):
+        """Returns the soil spec of a profile"""
+        return self.get_many([profile_id])[profile_id]
+
+    def get_many(self, profile_ids):
+        """Returns a dictionary of profile ids and soil specs, fetched in a
+        single query"""
+        rows = self.connection.execute(
+            "SELECT %s FROM profiles WHERE profile_id IN "
+            "(SELECT value FROM json_each(?))" % COLUMNS,
+            (json.dumps([str(profile_id) for profile_id in profile_ids]),),
+        ).fetchall()
+        specs = {row[0]: row_spec(row) for row in rows}
+        missing = set(map(str, profile_ids)) - set(specs)
+        assert not missing, "unknown soil profiles %s" % sorted(missing)
+        return specs
+
+    def profile_ids(self, texture=None):
+        """Returns the stored profile ids, of one texture class if given"""
+        if texture is None:
+            rows = self.connection.execute(
+                "SELECT profile_id FROM profiles ORDER BY profile_id"
+            )
+        else:
+            rows = self.connection.execute(
+                "SELECT profile_id FROM profiles WHERE texture_class = ? "
+                "ORDER BY profile_id",
+                (texture,),
+            )
+        return [row[0] for row in rows]
+
+    def by_texture(self, texture):
+        """Returns a dictionary of profile ids and soil specs of a texture
+        class"""
+        rows = self.connection.execute(
+            "SELECT %s FROM profiles WHERE texture_class = ?" % COLUMNS, (texture,)
+        ).fetchall()
+        return {row[0]: row_spec(row) for row in rows}
+
+    def texture_classes(self):
+        """Returns the number of stored profiles of each texture class"""
+        return dict(
+            self.connection.execute(
+                "SELECT texture_class, COUNT(*) FROM profiles GROUP BY texture_class"
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Stores the soil profiles of input files in a soil store"
+    )
+    parser.add_argument("store", help="SQLite soil store file")
+    parser.add_argument(
+        "input_files",
+        nargs="*",
+        help="input workbooks, JSON or TOML files, stored under their file name",
+    )
+    args = parser.parse_args()
+    from inputs import load_inputs
+
+    store = SoilStore(args.store)
+    store.add_soils(
+        {
+            os.path.splitext(os.path.basename(fname))[0]: load_inputs(
+                fname, None
+            ).soil_spec.soil
+            for fname in args.input_files
+        }
+    )
+    for texture, count in sorted(store.texture_classes().items()):
+        print("%-16s %d" % (texture, count))
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""Runs many water uptake simulations in a process pool, either one for each
+input workbook of a folder or manifest, or a parameter grid applied over a
+base workbook, and gathers the season totals in one results table"""
+#!/usr/bin/env python
+from __future__ import division
+import argparse
+import csv
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from inputs import (
+    CROP_ROWS,
+    FIRST_LAYER_ROW,
+    LAYER_COLUMNS,
+    SOIL_CELLS,
+    Cell,
+    TextBook,
+    load_inputs,
+    parse_book,
+    read_text,
+)
+
+# Workbook cell of each parameter that can be swept: (sheet, row, column).
+# Soil layer parameters have no row, their value is applied to every layer.
+SWEEP_PARAMETERS = {name: ("inputs", row, 1) for name, row in CROP_ROWS.items()}
+SWEEP_PARAMETERS["daily_ref_evap_transp"] = (
+    "soil",
+    *SOIL_CELLS["daily_ref_evap_transp"],
+)
+SWEEP_PARAMETERS.update(
+    (name, ("soil", None, col))
+    for name, col in LAYER_COLUMNS.items()
+    if name not in ["layer_thickness", "cum_depth"]
+)
+# Soil sheet cells that switch on manually entered soil properties
+MANUAL_FLAGS = {
+    "organic_matter": SOIL_CELLS["manual_organic_matter"],
+    "bulk_density": SOIL_CELLS["manual_bulk_density"],
+    "field_capacity": SOIL_CELLS["manual_field_capacity"],
+    "perm_wilt_point": SOIL_CELLS["manual_permanent_wilt_point"],
+}
+# Parameters read as whole numbers by Soil, other values would be truncated
+INTEGER_PARAMETERS = ["daily_ref_evap_transp"]
+INPUT_EXTENSIONS = (".xls", ".json", ".toml")
+RESULT_FIELDS = ["sim_days", "cum_transp", "cum_pot_transp", "transp_ratio"]
+
+
+class OverrideSheet(object):
+    """Worksheet whose cell values can be replaced without copying it"""
+
+    def __init__(self, sheet):
+        self.sheet = sheet
+        self.name = sheet.name
+        self.values = {}
+
+    def cell(self, row, col):
+        if (row, col) in self.values:
+            return Cell(self.values[(row, col)])
+        return self.sheet.cell(row, col)
+
+
+class OverrideBook(object):
+    """Input workbook with some parameters replaced
+
+    book: input workbook (sim_data.xls layout)
+    parameters: dictionary of SWEEP_PARAMETERS names and values
+    """
+
+    def __init__(self, book, parameters):
+        self.sheets = {
+            name: OverrideSheet(book.sheet_by_name(name)) for name in book.sheet_names()
+        }
+        sheet_soil = self.sheets["soil"]
+        total_layers = int(sheet_soil.cell(4, 2).value)
+        for name, value in parameters.items():
+            sheet_name, row, col = SWEEP_PARAMETERS[name]
+            if row is None:
+                for lyr in range(total_layers):
+                    self.sheets[sheet_name].values[(FIRST_LAYER_ROW + lyr, col)] = value
+            else:
+                self.sheets[sheet_name].values[(row, col)] = value
+            if name in MANUAL_FLAGS:
+                sheet_soil.values[MANUAL_FLAGS[name]] = 1
+
+    def sheet_by_name(self, name):
+        return self.sheets[name]
+
+    def sheet_names(self):
+        return list(self.sheets)
+
+
+@lru_cache(maxsize=None)
+def load_book(fname):
+    """Opens an input file once in each worker process"""
+    if fname.endswith(".xls"):
+        from xlrd import open_workbook
+
+        return open_workbook(fname)
+    return TextBook(read_text(fname))
+
+
+def run_case(case):
+    """Runs one simulation of the sweep and returns its result rows
+
+    case: (run number, input file, parameters, output folder or None,
+     model names or None)
+    """
+    from Model_water import simulate
+
+    run, fname, parameters, output_dir, models = case
+    if parameters:
+        sim_inputs = parse_book(OverrideBook(load_book(fname), parameters))
+    else:
+        sim_inputs = load_inputs(fname)
+    if output_dir is not None:
+        output_dir = os.path.join(output_dir, "run_%05d" % run)
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+    rows = []
+    for model, totals in simulate(sim_inputs, output_dir, models=models).items():
+        row = {"run": run, "workbook": fname, "model": model}
+        row.update(parameters)
+        row.update(totals)
+        rows.append(row)
+    return rows
+
+
+def input_workbooks(source):
+    """Returns the input files of a folder, of a manifest or a single file
+
+    A manifest is a text file with one workbook per line, relative to the
+    manifest folder. Empty lines and lines starting with # are skipped.
+    """
+    if os.path.isdir(source):
+        return sorted(
+            os.path.join(source, fname)
+            for fname in os.listdir(source)
+            if fname.endswith(INPUT_EXTENSIONS) and not fname.endswith("_output.xls")
+        )
+    if source.endswith(INPUT_EXTENSIONS):
+        return [source]
+    folder = os.path.dirname(source)
+    with open(source) as manifest:
+        lines = [line.strip() for line in manifest]
+    return [
+        os.path.join(folder, line)
+        for line in lines
+        if line and not line.startswith("#")
+    ]
+
+
+def parameter_grid(grid):
+    """Returns every combination of a grid of parameter values
+
+    grid: dictionary of SWEEP_PARAMETERS names and lists of values
+
+    >>> parameter_grid({"kl": [0.05, 0.1], "daily_ref_evap_transp": [5]})
+    [{'kl': 0.05, 'daily_ref_evap_transp': 5}, {'kl': 0.1, 'daily_ref_evap_transp': 5}]
+    >>> parameter_grid({})
+    [{}]
+    >>> parameter_grid({"daily_ref_evap_transp": [3.5]})
+    Traceback (most recent call last):
+    ...
+    AssertionError: daily_ref_evap_transp takes whole numbers, not 3.5
+    """
+    for name in grid:
+        assert name in SWEEP_PARAMETERS, "unknown sweep parameter %s" % name
+        if name in INTEGER_PARAMETERS:
+            for value in grid[name]:
+                message = "%s takes whole numbers, not %s" % (name, value)
+                assert float(value).is_integer(), message
+    names = list(grid)
+    return [
+        dict(zip(names, values))
+        for values in itertools.product(*[grid[name] for name in names])
+    ]
+
+
+def sweep(
+    workbooks, grid=None, output_dir=None, workers=None, chunksize=1, models=None
+):
+    """Runs every workbook with every combination of the parameter grid
+
+    workbooks: input workbook files
+    grid: dictionary of SWEEP_PARAMETERS names and lists of values
+    output_dir: folder of the output spreadsheets of each run, outputs are
+     not saved if None
+    workers: number of worker processes (default: number of CPUs)
+    chunksize: number of runs sent to a worker at once
+    models: names of the water uptake models to run (default: all of them)
+
+    Returns one result row for each run and model
+    """
+    cases = [
+        (run, fname, parameters, output_dir, models)
+        for run, (fname, parameters) in enumerate(
+            itertools.product(workbooks, parameter_grid(grid or {}))
+        )
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(run_case, cases, chunksize=chunksize)
+        return [row for rows in results for row in rows]
+
+
+def save_results(rows, fname):
+    """Saves the sweep result rows in a csv file"""
+    fields = ["run", "workbook", "model"]
+    for row in rows:
+        fields.extend(
+            name for name in row if name not in fields and name not in RESULT_FIELDS
+        )
+    fields.extend(RESULT_FIELDS)
+    with open(fname, "w", newline="") as out:
+        writer = csv.DictWriter(out, fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def grid_argument(text):
+    """Parses a name=value1,value2 grid argument"""
+    name, values = text.split("=")
+    if name not in SWEEP_PARAMETERS:
+        raise argparse.ArgumentTypeError("unknown sweep parameter %s" % name)
+    values = [float(value) for value in values.split(",")]
+    if name in INTEGER_PARAMETERS and not all(value.is_integer() for value in values):
+        raise argparse.ArgumentTypeError("%s takes whole numbers" % name)
+    return name, values
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "source", help="input workbook, folder of workbooks or manifest file"
+    )
+    parser.add_argument(
+        "--grid",
+        type=grid_argument,
+        action="append",
+        default=[],
+        help="parameter values as name=value1,value2 (repeatable)",
+    )
+    parser.add_argument(
+        "--models",
+        type=lambda text: text.split(","),
+        default=None,
+        help="comma separated models to run (default: all)",
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunksize", type=int, default=1)
+    parser.add_argument("--output-dir", default="sweep_output")
+    parser.add_argument(
+        "--summary-only",
+        action="store_true",
+        help="do not save the output spreadsheets of each run",
+    )
+    args = parser.parse_args()
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+    rows = sweep(
+        input_workbooks(args.source),
+        dict(args.grid),
+        None if args.summary_only else args.output_dir,
+        args.workers,
+        args.chunksize,
+        args.models,
+    )
+    save_results(rows, os.path.join(args.output_dir, "sweep_results.csv"))
+
+
+if __name__ == "__main__":
+    main()
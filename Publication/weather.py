@@ -0,0 +1,149 @@
+"""Daily weather records: reads a weather csv file once into a numpy
+record array, cached as a .npy file that later runs memory-map, and
+computes the reference evapotranspiration of the whole record at once
+
+The csv file has a header row with the WEATHER_COLUMNS, one row per day.
+The ref_evap_transp column is optional, it is otherwise computed from the
+weather (FAO-56 Penman-Monteith, see functions.ref_evap_transp):
+
+    python Model_water.py sim_data.xls --weather weather.csv --latitude 40.8 \
+        --elevation 350
+"""
+#!/usr/bin/env python
+from __future__ import division
+import argparse
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from functions import ref_evap_transp
+
+WEATHER_COLUMNS = [
+    "year",
+    "doy",
+    "temp_max",  # C
+    "temp_min",  # C
+    "rh_max",  # %
+    "rh_min",  # %
+    "solar_rad",  # MJ/m2/d
+    "wind_speed",  # m/s at 2 m
+]
+CACHE_DIR = ".weather_cache"
+
+
+def read_weather_csv(fname):
+    """Returns the days of a weather csv file as a record array"""
+    weather = np.genfromtxt(fname, delimiter=",", names=True, dtype=float)
+    missing = set(WEATHER_COLUMNS) - set(weather.dtype.names)
+    if "ref_evap_transp" in weather.dtype.names:
+        missing = missing & {"year", "doy"}
+    assert not missing, "%s has no %s columns" % (fname, ", ".join(sorted(missing)))
+    return weather
+
+
+def load_weather(fname, cache_dir=CACHE_DIR):
+    """Returns the days of a weather csv file as a record array
+
+    fname: weather csv file
+    cache_dir: folder of the parsed weather cache, keyed by the file hash;
+     cached records are memory-mapped instead of read. No cache if None.
+    """
+    if cache_dir is None:
+        return read_weather_csv(fname)
+    key = hashlib.sha256()
+    with open(fname, "rb") as weather_file:
+        for block in iter(lambda: weather_file.read(1 << 20), b""):
+            key.update(block)
+    cache_file = os.path.join(cache_dir, key.hexdigest() + ".npy")
+    if os.path.exists(cache_file):
+        try:
+            return np.load(cache_file, mmap_mode="r")
+        except (EOFError, ValueError):
+            # Truncated file, read again and replaced
+            pass
+    os.makedirs(cache_dir, exist_ok=True)
+    # Written under a temporary name, other processes never map a partial
+    # file
+    with tempfile.NamedTemporaryFile(dir=cache_dir, delete=False) as cached:
+        np.save(cached, read_weather_csv(fname))
+    os.replace(cached.name, cache_file)
+    return np.load(cache_file, mmap_mode="r")
+
+
+def daily_ref_evap_transp(weather, latitude=None, elevation=None):
+    """Returns the reference evapotranspiration of each day of a weather
+    record, mm/d
+
+    The ref_evap_transp column is used if the record has one, otherwise it
+    is computed for the whole record in one pass.
+
+    latitude: latitude of the site (degrees, negative south)
+    elevation: elevation of the site (m)
+    """
+    if "ref_evap_transp" in weather.dtype.names:
+        return np.array(weather["ref_evap_transp"])
+    assert latitude is not None and elevation is not None, (
+        "the site latitude and elevation are needed to compute the reference "
+        "evapotranspiration"
+    )
+    return ref_evap_transp(
+        weather["temp_max"],
+        weather["temp_min"],
+        weather["rh_max"],
+        weather["rh_min"],
+        weather["solar_rad"],
+        weather["wind_speed"],
+        weather["doy"],
+        latitude,
+        elevation,
+    )
+
+
+def sim_day_values(weather, values, years, days_of_year):
+    """Returns the values of a weather record on the simulation days
+
+    weather: weather record
+    values: array with one value per weather day, e.g. daily_ref_evap_transp
+    years, days_of_year: arrays with the dates of the simulation days
+
+    >>> weather = np.rec.fromarrays([[2001, 2001, 2002], [365, 1, 1]],
+    ...                             names="year,doy")
+    >>> sim_day_values(weather, np.array([5.0, 4.0, 6.0]),
+    ...                np.array([2001, 2002]), np.array([365, 1]))
+    array([5., 6.])
+    """
+    day_keys = np.asarray(weather["year"] * 1000 + weather["doy"], dtype=np.int64)
+    order = np.argsort(day_keys, kind="stable")
+    sim_keys = np.asarray(years, dtype=np.int64) * 1000 + days_of_year
+    found = np.searchsorted(day_keys, sim_keys, sorter=order).clip(0, len(day_keys) - 1)
+    rows = order[found]
+    missing = day_keys[rows] != sim_keys
+    assert not missing.any(), "no weather on day %d of %d" % (
+        days_of_year[missing][0],
+        years[missing][0],
+    )
+    return values[rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Prints the reference evapotranspiration of a weather file"
+    )
+    parser.add_argument("weather_file")
+    parser.add_argument("--latitude", type=float, help="degrees, negative south")
+    parser.add_argument("--elevation", type=float, help="m")
+    parser.add_argument(
+        "--no-cache", action="store_true", help="do not cache the parsed weather"
+    )
+    args = parser.parse_args()
+    weather = load_weather(args.weather_file, None if args.no_cache else CACHE_DIR)
+    ref_et = daily_ref_evap_transp(weather, args.latitude, args.elevation)
+    print("year  doy  ref_evap_transp")
+    for year, doy, value in zip(weather["year"], weather["doy"], ref_et):
+        print("%4d  %3d  %15.3f" % (year, doy, value))
+
+
+if __name__ == "__main__":
+    main()